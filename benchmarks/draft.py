@@ -0,0 +1,79 @@
+"""
+Compares thumbnail generation from large JPEGs with and without draft-mode
+(reduced scale) decoding. Each run happens in a fresh process so that its
+peak memory can be measured.
+
+Usage::
+
+  python benchmarks/draft.py [megapixels] [repeat]
+
+"""
+from __future__ import print_function
+
+import os
+import os.path
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from django.conf import settings
+if not settings.configured:
+  settings.configure()
+
+from PIL import Image
+from synthetic import make_image
+from multimedia.utilities import compute_format, make_thumbnail
+
+
+FORMATS = ['100x100,square', '200x200', '800x600']
+
+
+def make_source(directory, megapixels):
+  width  = int((megapixels * 1e6 * 3 / 2) ** 0.5)
+  height = width * 2 // 3
+  path = os.path.join(directory, 'source.jpg')
+  make_image((width, height), 'RGB').save(path, quality=90)
+  return path
+
+
+def run(src, format, draft, repeat, results):
+  dst = os.path.join(os.path.dirname(src), 'thumbnail.jpg')
+  start = time.time()
+  for i in range(repeat):
+    make_thumbnail(src, format, dst, draft=draft)
+  elapsed = (time.time() - start) / repeat
+  results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def measure(src, format, draft, repeat):
+  results = Queue()
+  process = Process(target=run, args=(src, format, draft, repeat, results))
+  process.start()
+  result = results.get()
+  process.join()
+  return result
+
+
+def main(megapixels=24, repeat=3):
+  directory = tempfile.mkdtemp()
+  try:
+    src = make_source(directory, megapixels)
+    print('source: %s pixels, %.1f MB' % ('x'.join(map(str, Image.open(src).size)), os.path.getsize(src) / 1e6))
+    print('%-16s %10s %10s %10s %10s %8s' % ('format', 'full ms', 'draft ms', 'full MB', 'draft MB', 'speedup'))
+    for spec in FORMATS:
+      format = compute_format('200x200,!square,round=0,bg=ffffff', spec)
+      full_time, full_rss = measure(src, format, False, repeat)
+      draft_time, draft_rss = measure(src, format, True, repeat)
+      print('%-16s %10.1f %10.1f %10.1f %10.1f %7.1fx' % (spec, full_time * 1000, draft_time * 1000,
+        full_rss / 1024.0, draft_rss / 1024.0, full_time / draft_time))
+  finally:
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,124 @@
+"""
+Times the listing queries of the admin changelist, {% recent_media %} and
+multimedia_warm on a synthetic SQLite multimedia_media table, before and
+after adding the indexes of the Media model (db_index fields and
+multimedia/sql/media.sql).
+
+Usage::
+
+  python benchmarks/indexes.py [rows] [repeat]
+
+"""
+from __future__ import print_function
+
+import os
+import os.path
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+SQL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'multimedia', 'sql', 'media.sql')
+
+TABLE = """
+CREATE TABLE multimedia_media (
+  id integer NOT NULL PRIMARY KEY,
+  mediafile varchar(256) NOT NULL,
+  kind varchar(1) NOT NULL,
+  caption text NOT NULL,
+  tags varchar(255) NOT NULL,
+  attribution_name varchar(128) NOT NULL,
+  attribution_url varchar(1024) NOT NULL,
+  taken datetime NULL,
+  imported datetime NOT NULL,
+  width integer unsigned NOT NULL,
+  height integer unsigned NOT NULL,
+  metadata text NULL,
+  signature varchar(64) NOT NULL
+)"""
+
+# the indexes created by syncdb for the db_index fields
+FIELD_INDEXES = [
+  'CREATE INDEX multimedia_media_taken ON multimedia_media (taken)',
+  'CREATE INDEX multimedia_media_imported ON multimedia_media (imported)',
+]
+
+LIST_COLUMNS = 'id, mediafile, kind, caption, tags, attribution_name, attribution_url, taken, imported, width, height, signature'
+
+NOW = datetime(2009, 6, 1)
+
+QUERIES = [
+  ('recent_media', 'SELECT %s, metadata FROM multimedia_media ORDER BY imported DESC LIMIT 10' % LIST_COLUMNS, ()),
+  ('recent_media deferred', 'SELECT %s FROM multimedia_media ORDER BY imported DESC LIMIT 10' % LIST_COLUMNS, ()),
+  ('changelist', 'SELECT %s FROM multimedia_media ORDER BY imported DESC LIMIT 100 OFFSET 2000' % LIST_COLUMNS, ()),
+  ('filter imported', 'SELECT %s FROM multimedia_media WHERE imported >= ? AND imported < ? ORDER BY imported DESC LIMIT 100' % LIST_COLUMNS,
+    (str(NOW - timedelta(days=7)), str(NOW))),
+  ('filter taken', 'SELECT %s FROM multimedia_media WHERE taken >= ? AND taken < ? ORDER BY imported DESC LIMIT 100' % LIST_COLUMNS,
+    (str(datetime(NOW.year, NOW.month, 1) - timedelta(days=30)), str(datetime(NOW.year, NOW.month, 1)))),
+  ('warm chunk', "SELECT id, mediafile, width, height FROM multimedia_media WHERE kind = 'i' AND id > ? ORDER BY id LIMIT 500", (200000,)),
+]
+
+
+def populate(db, rows):
+  random.seed(0)
+  metadata = 'Make: Canon\nModel: Canon EOS 5D\n' + 'x' * 2000 # EXIF text plus a large blob
+  def generate():
+    for i in range(1, rows + 1):
+      imported = NOW - timedelta(seconds=random.randint(0, 5 * 365 * 86400))
+      taken = imported - timedelta(days=random.randint(0, 30))
+      kind = random.random() < 0.9 and 'i' or random.choice('am')
+      yield (i, 'content/%d.jpg' % i, kind, 'caption %d' % i, '', '', '', str(taken), str(imported), 800, 600, metadata, '')
+  db.executemany('INSERT INTO multimedia_media VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)', generate())
+  db.commit()
+
+
+def sql_file_indexes():
+  text = re.sub(r'--[^\n]*', '', open(SQL_FILE).read())
+  return [statement.strip() for statement in text.split(';') if statement.strip()]
+
+
+def measure(db, repeat):
+  results = {}
+  for name, sql, params in QUERIES:
+    start = time.time()
+    for i in range(repeat):
+      db.execute(sql, params).fetchall()
+    results[name] = (time.time() - start) / repeat
+  return results
+
+
+def plan(db, sql, params):
+  return '; '.join([row[-1] for row in db.execute('EXPLAIN QUERY PLAN ' + sql, params)])
+
+
+def main(rows=400000, repeat=5):
+  fd, path = tempfile.mkstemp(suffix='.sqlite')
+  os.close(fd)
+  try:
+    db = sqlite3.connect(path)
+    db.execute(TABLE)
+    populate(db, rows)
+    before = measure(db, repeat)
+    for statement in FIELD_INDEXES + sql_file_indexes():
+      db.execute(statement)
+    db.execute('ANALYZE')
+    after = measure(db, repeat)
+
+    print('%d rows' % rows)
+    print('%-22s %12s %12s %9s' % ('query', 'before ms', 'after ms', 'speedup'))
+    for name, sql, params in QUERIES:
+      print('%-22s %12.2f %12.2f %8.0fx' % (name, before[name] * 1000, after[name] * 1000, before[name] / after[name]))
+    print()
+    for name, sql, params in QUERIES:
+      print('%-22s %s' % (name, plan(db, sql, params)))
+    db.close()
+  finally:
+    os.remove(path)
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:3]])
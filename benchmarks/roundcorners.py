@@ -0,0 +1,92 @@
+"""
+Compares the corner-tile implementation of roundcorners.round_image with the
+previous full-image one (which built, cached and inverted a full-size mask
+for every thumbnail size) on thumbnails of many distinct sizes.
+
+Usage::
+
+  python benchmarks/roundcorners.py [sizes] [repeat]
+
+"""
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image, ImageChops
+from synthetic import make_image
+from multimedia import roundcorners
+from multimedia.roundcorners import create_rounded_rectangle, round_image, ROUNDED_POS
+
+
+def legacy_round_image(image, cache, radius=100, fill=255, pos=ROUNDED_POS, bg_color='#FFFFFF'):
+  if image.mode != 'RGBA':
+    image = image.convert('RGBA')
+  mask = create_rounded_rectangle(image.size, cache, radius, fill, pos)
+  image.paste(Image.new('RGB', image.size, bg_color), (0, 0), ImageChops.invert(mask))
+  image.putalpha(mask)
+  return image
+
+
+def sources(count):
+  # thumbnails of distinct sizes, like those of a gallery of photos
+  base = make_image((400, 400), 'RGB')
+  return [base.resize((200 + i % 200, 150 + (i * 7) % 50)) for i in range(count)]
+
+
+def cache_bytes(images):
+  total = 0
+  for image in images:
+    total += image.size[0] * image.size[1] * len(image.getbands())
+  return total
+
+
+def legacy_cache_images(cache):
+  return [value for value in cache.values() if isinstance(value, Image.Image)]
+
+
+def new_cache_images():
+  images = []
+  for masks, background in roundcorners.corner_cache.values():
+    images.extend([mask for mask in masks if mask is not None])
+    images.append(background)
+  return images
+
+
+def main(count=500, repeat=3):
+  images = sources(count)
+  legacy_cache = {}
+
+  start = time.time()
+  for i in range(repeat):
+    for image in images:
+      legacy_round_image(image.copy(), legacy_cache, radius=10, bg_color='#ffffff')
+  legacy_time = (time.time() - start) / (repeat * count)
+
+  roundcorners.corner_cache.clear()
+  start = time.time()
+  for i in range(repeat):
+    for image in images:
+      round_image(image.copy(), radius=10, bg_color='#ffffff')
+  new_time = (time.time() - start) / (repeat * count)
+
+  differences = 0
+  for image in images[:50]:
+    a = legacy_round_image(image.copy(), legacy_cache, radius=10, bg_color='#ffffff')
+    b = round_image(image.copy(), radius=10, bg_color='#ffffff')
+    if ImageChops.difference(a, b).getbbox():
+      differences += 1
+
+  print('%d thumbnails of %d distinct sizes, radius 10' % (count, len(set([i.size for i in images]))))
+  print('%-10s %14s %18s' % ('', 'us/thumbnail', 'cache (KB)'))
+  print('%-10s %14.1f %18.1f' % ('legacy', legacy_time * 1e6, cache_bytes(legacy_cache_images(legacy_cache)) / 1024.0))
+  print('%-10s %14.1f %18.1f' % ('tiles', new_time * 1e6, cache_bytes(new_cache_images()) / 1024.0))
+  print('speedup %.1fx; %d of 50 outputs differ' % (legacy_time / new_time, differences))
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:3]])
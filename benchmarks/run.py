@@ -0,0 +1,275 @@
+"""
+Benchmark suite of the imaging and rendering paths, run offline against
+synthetic images and a temporary SQLite database.
+
+Each benchmark runs in a fresh process, so that its peak memory can be
+measured, and reports its throughput (operations per second), latency
+percentiles and the peak RSS of its process (source images are written
+before any benchmark process starts). Results can be saved as a baseline and
+later runs compared against it.
+
+Usage::
+
+  python benchmarks/run.py [--quick] [--only=NAME,...] [--save=FILE] [--compare=FILE]
+
+Benchmarks:
+
+  thumbnail-<format>  make_thumbnail() of every source image (sizes x modes x types)
+  round_image         roundcorners.round_image() on thumbnails of distinct sizes
+  parse_format        parse_format() of format strings
+  extract_exif        extract_exif() of JPEGs with an EXIF block
+  update_media        Media.save() of new media, i.e. update_media()
+  render              a page of N {% thumbnail %} tags whose thumbnails exist
+
+"""
+from __future__ import print_function
+
+import json
+import os
+import os.path
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Process, Queue
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DIRECTORY = tempfile.mkdtemp(prefix='multimedia-benchmarks-')
+DATABASE  = os.path.join(DIRECTORY, 'db.sqlite')
+
+from django.conf import settings
+if not settings.configured:
+  settings.configure(
+    DATABASE_ENGINE='sqlite3', DATABASE_NAME=DATABASE,
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': DATABASE}},
+    INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.sites', 'tagging', 'multimedia'],
+    MEDIA_ROOT=os.path.join(DIRECTORY, 'media') + '/', MEDIA_URL='/media/', SITE_ID=1,
+    MULTIMEDIA_EXIFTOOL=None)
+
+from PIL import Image
+from synthetic import exif_block, make_image, save_jpeg
+
+
+SIZES = [(640, 480), (3000, 2000)]
+TYPES = {'.jpg': ('RGB', 'L'), '.png': ('RGB', 'RGBA', 'P', 'L'), '.gif': ('P', 'L')}
+
+FORMATS = {
+  'small':   '100x100,!square,round=0',
+  'square':  '100x100,square,round=0',
+  'rounded': '200x200,!square,round=10,bg=ffffff',
+  'large':   '800x600,!square,round=0',
+}
+
+FORMAT_STRINGS = ['200x200', '100x100,square', '400x300,round=10,bg=ff0000', '640x480,!square,round=0,type=png',
+                  '120x120,square,round=5,bg=000000,quality=80,progressive,optimize']
+
+
+def make_sources(sizes):
+  "Writes a source image of every size, mode and type, and returns their paths."
+  directory = os.path.join(DIRECTORY, 'sources')
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  paths = []
+  for size in sizes:
+    for ext, modes in sorted(TYPES.items()):
+      for mode in modes:
+        path = os.path.join(directory, '%dx%d-%s%s' % (size[0], size[1], mode, ext))
+        if not os.path.exists(path):
+          if ext == '.jpg':
+            save_jpeg(make_image(size, mode), path, exif=exif_block(), quality=90)
+          else:
+            make_image(size, mode).save(path)
+        paths.append(path)
+  return paths
+
+
+def maxrss_mb():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def timed(function, items, repeat):
+  latencies = []
+  for i in range(repeat):
+    for item in items:
+      start = time.time()
+      function(item)
+      latencies.append(time.time() - start)
+  return latencies
+
+
+def bench_thumbnail(options, name):
+  from multimedia.utilities import compute_format, make_thumbnail
+  format = compute_format(FORMATS[name])
+  out = os.path.join(DIRECTORY, 'thumbnails')
+  if not os.path.isdir(out):
+    os.makedirs(out)
+  def run(src):
+    make_thumbnail(src, format, os.path.join(out, os.path.basename(src)))
+  return run, make_sources(options.sizes), options.repeat
+
+
+def bench_round_image(options):
+  from multimedia.roundcorners import round_image
+  base = make_image((400, 400), 'RGB')
+  images = [base.resize((200 + i % 200, 150 + (i * 7) % 50)) for i in range(options.count * 5)]
+  return lambda image: round_image(image.copy(), radius=10, bg_color='#ffffff'), images, options.repeat
+
+
+def bench_parse_format(options):
+  from multimedia.utilities import parse_format
+  return parse_format, FORMAT_STRINGS * 100, options.repeat
+
+
+def bench_extract_exif(options):
+  from multimedia.utilities import extract_exif
+  paths = [path for path in make_sources(options.sizes) if path.endswith('.jpg')]
+  return lambda path: extract_exif(path, Image.open(path)), paths * 10, options.repeat
+
+
+def bench_update_media(options):
+  from multimedia.models import Media
+  setup_database()
+  sources = make_sources(options.sizes)
+  names = []
+  for i in range(options.repeat):
+    for src in sources:
+      name = 'content/%d-%s' % (i, os.path.basename(src))
+      shutil.copy(src, os.path.join(settings.MEDIA_ROOT, name))
+      names.append(name)
+  return lambda name: Media(mediafile=name).save(), names, 1
+
+
+def bench_render(options):
+  from django.template import Context, Template
+  from multimedia.models import Media
+  setup_database()
+  src = make_sources([(640, 480)])[0]
+  ids = []
+  for i in range(options.count):
+    name = 'content/page-%d.jpg' % i
+    shutil.copy(src, os.path.join(settings.MEDIA_ROOT, name))
+    media = Media(mediafile=name)
+    media.save()
+    ids.append(media.id)
+  page = Template('{% load multimedia_tags %}{% prefetch_media %}' +
+                  ''.join(['{%% thumbnail %d %%}' % id for id in ids]) + '{% endprefetch_media %}')
+  page.render(Context({})) # generates the thumbnails
+  return lambda i: page.render(Context({})), range(10), options.repeat
+
+
+def setup_database():
+  from django.core.management import call_command
+  content = os.path.join(settings.MEDIA_ROOT, 'content')
+  if not os.path.isdir(content):
+    os.makedirs(content)
+  call_command('syncdb', interactive=False, verbosity=0)
+
+
+def benchmarks():
+  result = [('thumbnail-' + name, bench_thumbnail, (name,)) for name in sorted(FORMATS)]
+  result += [('round_image', bench_round_image, ()), ('parse_format', bench_parse_format, ()),
+             ('extract_exif', bench_extract_exif, ()), ('update_media', bench_update_media, ()),
+             ('render', bench_render, ())]
+  return result
+
+
+def percentile(latencies, q):
+  return latencies[int(round(q * (len(latencies) - 1)))]
+
+
+def run(benchmark, args, options, results):
+  try:
+    function, items, repeat = benchmark(options, *args) # setup
+    latencies = sorted(timed(function, items, repeat))
+    total = sum(latencies)
+    results.put({
+      'ops':        len(latencies),
+      'throughput': len(latencies) / max(total, 1e-9),
+      'p50_ms':     percentile(latencies, 0.50) * 1000,
+      'p95_ms':     percentile(latencies, 0.95) * 1000,
+      'p99_ms':     percentile(latencies, 0.99) * 1000,
+      'peak_rss_mb': maxrss_mb(),
+    })
+  except Exception as e:
+    results.put({'error': '%s: %s' % (e.__class__.__name__, e)})
+
+
+def measure(function, args, options):
+  if os.path.exists(DATABASE):
+    os.remove(DATABASE)
+  shutil.rmtree(settings.MEDIA_ROOT, True)
+  results = Queue()
+  process = Process(target=run, args=(function, args, options, results))
+  process.start()
+  result = results.get()
+  process.join()
+  return result
+
+
+def change(new, old, key):
+  if not old or key not in old or not old[key]:
+    return ''
+  return '%+.0f%%' % ((new[key] - old[key]) * 100.0 / old[key])
+
+
+def main():
+  parser = OptionParser(usage='%prog [options]')
+  parser.add_option('--quick', action='store_true', default=False, help='small images and fewer repetitions')
+  parser.add_option('--only', default=None, help='comma-separated names (or name prefixes) of the benchmarks to run')
+  parser.add_option('--repeat', type='int', default=3)
+  parser.add_option('--count', type='int', default=50, help='thumbnails per rendered page')
+  parser.add_option('--save', default=None, help='write the results to this JSON file')
+  parser.add_option('--compare', default=None, help='compare the results with this JSON file')
+  options, args = parser.parse_args()
+  options.sizes = SIZES
+  if options.quick:
+    options.sizes = SIZES[:1]
+    options.repeat = 1
+    options.count = 10
+
+  baseline = {}
+  if options.compare:
+    baseline = json.load(open(options.compare))['results']
+
+  # written once, outside the measured processes
+  make_sources(options.sizes)
+  make_sources([(640, 480)])
+
+  results = {}
+  print('%-20s %8s %10s %10s %10s %10s %10s %12s %12s' % ('benchmark', 'ops', 'ops/s', 'p50 ms', 'p95 ms',
+    'p99 ms', 'peak MB', 'vs ops/s', 'vs p50'))
+  try:
+    for name, function, fargs in benchmarks():
+      if options.only and not [n for n in options.only.split(',') if name.startswith(n)]:
+        continue
+      result = results[name] = measure(function, fargs, options)
+      if 'error' in result:
+        print('%-20s failed: %s' % (name, result['error']))
+        continue
+      old = baseline.get(name)
+      print('%-20s %8d %10.1f %10.2f %10.2f %10.2f %10.1f %12s %12s' % (name, result['ops'], result['throughput'],
+        result['p50_ms'], result['p95_ms'], result['p99_ms'], result['peak_rss_mb'],
+        change(result, old, 'throughput'), change(result, old, 'p50_ms')))
+      sys.stdout.flush()
+  finally:
+    shutil.rmtree(DIRECTORY, True)
+
+  if options.save:
+    import PIL
+    environment = {'python': platform.python_version(), 'platform': platform.platform(),
+                   'pil': getattr(PIL, '__version__', getattr(PIL, 'VERSION', None)),
+                   'date': datetime.now().isoformat(), 'quick': options.quick}
+    f = open(options.save, 'w')
+    try:
+      json.dump({'environment': environment, 'results': results}, f, indent=2, sort_keys=True)
+    finally:
+      f.close()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,64 @@
+"""
+Synthetic source images shared by the benchmarks. Only the API of the
+original PIL is used, so they run under PIL as well as Pillow.
+"""
+import struct
+
+from PIL import Image
+
+
+def linear_gradient():
+  "Returns a 256x256 'L' image going from black at the top to white at the bottom."
+  image = Image.new('L', (256, 256))
+  image.putdata([y for y in range(256) for x in range(256)])
+  return image
+
+
+def make_image(size, mode):
+  # a gradient compresses like a photo far better than a flat color
+  gradient = linear_gradient()
+  image = Image.merge('RGB', [gradient.resize(size), gradient.rotate(90).resize(size),
+                              gradient.rotate(45).resize(size)])
+  if mode == 'RGBA':
+    image.putalpha(gradient.resize(size))
+  elif mode == 'P':
+    image = image.convert('P', palette=Image.ADAPTIVE)
+  elif mode != 'RGB':
+    image = image.convert(mode)
+  return image
+
+
+EXIF_TAGS = [
+  (0x010f, 'Canon'),                # Make
+  (0x0110, 'Canon EOS 5D'),         # Model
+  (0x9003, '2009:01:01 12:00:00'),  # DateTimeOriginal
+]
+
+
+def exif_block():
+  "Returns the payload of an EXIF APP1 segment holding EXIF_TAGS, as ASCII entries of IFD0."
+  offset = 8 + 2 + 12 * len(EXIF_TAGS) + 4 # TIFF header, entry count, entries, next IFD
+  entries, data = [struct.pack('<H', len(EXIF_TAGS))], []
+  for tag, value in EXIF_TAGS:
+    value = value.encode('ascii') + b'\0'
+    entries.append(struct.pack('<HHII', tag, 2, len(value), offset))
+    data.append(value)
+    offset += len(value)
+  entries.append(struct.pack('<I', 0))
+  return b'Exif\0\0' + b'II*\0' + struct.pack('<I', 8) + b''.join(entries) + b''.join(data)
+
+
+def save_jpeg(image, path, exif=None, **options):
+  "Saves image as a JPEG, inserting the EXIF block right after the start of image marker if given."
+  image.save(path, 'JPEG', **options)
+  if exif:
+    f = open(path, 'rb')
+    try:
+      content = f.read()
+    finally:
+      f.close()
+    f = open(path, 'wb')
+    try:
+      f.write(content[:2] + b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif + content[2:])
+    finally:
+      f.close()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from multimedia.models import Media
+from multimedia.models import Media, defer_metadata
 
 
 class MediaAdmin(admin.ModelAdmin):
@@ -7,8 +7,14 @@ class MediaAdmin(admin.ModelAdmin):
   list_filter = ('taken','imported')
   save_on_top = True
   search_fields = ('caption',)
+  actions = ['regenerate_thumbnails']
+
+  def queryset(self,request):
+    return defer_metadata(super(MediaAdmin,self).queryset(request))
   
   def admin_img_tag(self,media):
+    # never generates thumbnails: missing ones are generated by the thumbnail
+    # view when the browser requests them, one request per thumbnail
     thumbnail = media.admin_thumbnail()
     if thumbnail:
       return thumbnail.as_img_tag()
@@ -16,5 +22,13 @@ class MediaAdmin(admin.ModelAdmin):
       return None
   admin_img_tag.allow_tags = True
 
+  def regenerate_thumbnails(self,request,queryset):
+    count = 0
+    for media in queryset:
+      media.regenerate_thumbnails()
+      count += 1
+    self.message_user(request,'Regenerating the thumbnails of %d media in the background.' % count)
+  regenerate_thumbnails.short_description = 'Regenerate thumbnails'
+
 
 admin.site.register(Media,MediaAdmin)
@@ -0,0 +1,59 @@
+"""
+Content and perceptual hashes, used to find duplicate media.
+
+Exact duplicates have the same content hash (the SHA-1 of the file as it was
+uploaded, before any downscaling). Near duplicates (the same photo resized,
+recompressed or slightly edited) have difference hashes (dHash) that differ
+in few bits. Each 64 bit dHash is split into BANDS bands of 16 bits, stored
+as HashBuckets: two hashes that differ in fewer than BANDS bits share at
+least one band, so near duplicates are found with an indexed lookup of the
+buckets rather than by comparing every hash.
+"""
+
+from hashlib import sha1
+
+from PIL import Image
+
+
+BANDS = 4
+
+
+def file_hash(f):
+  "Returns the SHA-1 hex digest of the contents of an open file."
+  digest = sha1()
+  while True:
+    data = f.read(1 << 16)
+    if not data:
+      break
+    digest.update(data)
+  return digest.hexdigest()
+
+
+def dhash(image):
+  """
+  Returns the 64 bit difference hash of a PIL image, as 16 hex digits. Large
+  JPEGs should be drafted to a reduced scale by the caller (see
+  utilities.reduced_image).
+  """
+  small = image.convert('L').resize((9,8),Image.ANTIALIAS)
+  pixels = list(small.getdata())
+  bits = 0
+  for row in range(8):
+    for col in range(8):
+      bits = bits << 1 | (pixels[row*9+col] > pixels[row*9+col+1])
+  return '%016x' % bits
+
+
+def bands(hash):
+  "Returns the 16 bit bands of a dHash, as (band, value) pairs."
+  return [(band,int(hash[band*4:band*4+4],16)) for band in range(BANDS)]
+
+
+def hamming(a,b):
+  "Returns the number of bits in which two dHashes differ."
+  bits = int(a,16) ^ int(b,16)
+  count = 0
+  while bits:
+    bits &= bits - 1
+    count += 1
+  return count
@@ -0,0 +1,212 @@
+"""
+EXIF extraction.
+
+Tags are read in-process from the EXIF block that PIL has already parsed
+while opening the image. Files whose metadata PIL can't read are handed to a
+single, long-running exiftool process (exiftool -stay_open), so that Perl is
+started once rather than for every file.
+
+Values are formatted the way "exiftool -s -t" prints them.
+"""
+from __future__ import with_statement
+
+import os
+import threading
+from subprocess import Popen, PIPE
+
+from PIL.ExifTags import TAGS
+
+
+# the tags extracted from each file
+EXIF_TAGS = ['Make','Model','DateTimeOriginal','FocalLength','ShutterSpeed','Aperture','ISO','Flash']
+
+# image formats whose EXIF block PIL parses
+PIL_EXIF_FORMATS = ('JPEG','MPO','TIFF','WEBP')
+
+EXIF_IFD = 0x8769
+
+FLASH = {
+  0x00: 'No Flash',
+  0x01: 'Fired',
+  0x05: 'Fired, Return not detected',
+  0x07: 'Fired, Return detected',
+  0x08: 'On, Did not fire',
+  0x09: 'On, Fired',
+  0x0d: 'On, Return not detected',
+  0x0f: 'On, Return detected',
+  0x10: 'Off, Did not fire',
+  0x14: 'Off, Did not fire, Return not detected',
+  0x18: 'Auto, Did not fire',
+  0x19: 'Auto, Fired',
+  0x1d: 'Auto, Fired, Return not detected',
+  0x1f: 'Auto, Fired, Return detected',
+  0x20: 'No flash function',
+  0x30: 'Off, No flash function',
+  0x41: 'Fired, Red-eye reduction',
+  0x45: 'Fired, Red-eye reduction, Return not detected',
+  0x47: 'Fired, Red-eye reduction, Return detected',
+  0x49: 'On, Red-eye reduction',
+  0x4d: 'On, Red-eye reduction, Return not detected',
+  0x4f: 'On, Red-eye reduction, Return detected',
+  0x50: 'Off, Red-eye reduction',
+  0x58: 'Auto, Did not fire, Red-eye reduction',
+  0x59: 'Auto, Fired, Red-eye reduction',
+  0x5d: 'Auto, Fired, Red-eye reduction, Return not detected',
+  0x5f: 'Auto, Fired, Red-eye reduction, Return detected',
+}
+
+
+def read_exif(image):
+  """
+  Returns the tags in EXIF_TAGS found in an open PIL image, or None if PIL
+  can't read the image's metadata.
+  """
+  if image.format not in PIL_EXIF_FORMATS:
+    return None
+  try:
+    raw = raw_exif(image)
+  except Exception:
+    return None
+  tags = {}
+  for tag, value in raw.items():
+    tags[TAGS.get(tag,tag)] = value
+
+  result = {}
+  for name in ('Make','Model','DateTimeOriginal'):
+    if tags.get(name):
+      result[name] = text(tags[name])
+  if tags.get('FocalLength'):
+    result['FocalLength'] = '%.1f mm' % rational(tags['FocalLength'])
+  if tags.get('ExposureTime'):
+    result['ShutterSpeed'] = exposure_time(rational(tags['ExposureTime']))
+  elif tags.get('ShutterSpeedValue') is not None:
+    result['ShutterSpeed'] = exposure_time(2 ** -rational(tags['ShutterSpeedValue']))
+  if tags.get('FNumber'):
+    result['Aperture'] = number(rational(tags['FNumber']))
+  elif tags.get('ApertureValue') is not None:
+    result['Aperture'] = number(2 ** (rational(tags['ApertureValue']) / 2))
+  iso = tags.get('ISOSpeedRatings')
+  if type(iso) in (tuple,list):
+    iso = iso and iso[0]
+  if iso:
+    result['ISO'] = str(iso)
+  if tags.get('Flash') is not None:
+    result['Flash'] = FLASH.get(tags['Flash'], 'Unknown (%d)' % tags['Flash'])
+  return result
+
+
+def raw_exif(image):
+  if hasattr(image,'_getexif'):
+    return image._getexif() or {}
+  exif = image.getexif()
+  result = dict(exif)
+  if hasattr(exif,'get_ifd'):
+    result.update(exif.get_ifd(EXIF_IFD))
+  return result
+
+
+def text(value):
+  if type(value) is tuple:
+    value = value[0]
+  return str(value).strip('\x00 ')
+
+
+def rational(value):
+  # old versions of PIL return (numerator, denominator) tuples
+  if type(value) is tuple:
+    numerator, denominator = value
+    if not denominator:
+      return 0.0
+    return float(numerator) / denominator
+  return float(value)
+
+
+def number(value):
+  s = '%.1f' % value
+  if s.endswith('.0'):
+    s = s[:-2]
+  return s
+
+
+def exposure_time(seconds):
+  if 0 < seconds < 0.25001:
+    return '1/%d' % int(0.5 + 1 / seconds)
+  return number(seconds)
+
+
+class ExifTool(object):
+  "A single exiftool process, kept running in -stay_open mode and fed one file at a time."
+
+  sentinel = '{ready}'
+
+  def __init__(self, executable='exiftool'):
+    self.executable = executable
+    self.process    = None
+    self.devnull    = None # stderr of the process, opened once
+    self._lock      = threading.Lock()
+
+  def extract(self, filepath, tags=EXIF_TAGS):
+    args = ['-s','-t'] + ['-'+tag for tag in tags] + [filepath]
+    result = {}
+    for line in self.execute(args).split('\n'):
+      if '\t' in line:
+        tag, value = line.split('\t',1)
+        result[tag] = value.strip()
+    return result
+
+  def execute(self, args):
+    # arguments are passed one per line, so paths may contain spaces
+    with self._lock:
+      if self.process is None or self.process.poll() is not None:
+        self.start()
+      try:
+        self.process.stdin.write('\n'.join(args) + '\n-execute\n')
+        self.process.stdin.flush()
+        output = ''
+        fd = self.process.stdout.fileno()
+        while not output.rstrip().endswith(self.sentinel):
+          data = os.read(fd,4096)
+          if not data:
+            raise IOError('exiftool exited unexpectedly')
+          output += data
+      except (IOError,OSError):
+        self.discard()
+        raise
+    return output.rstrip()[:-len(self.sentinel)]
+
+  def start(self):
+    self.discard()
+    if self.devnull is None:
+      self.devnull = open(os.devnull,'w')
+    self.process = Popen([self.executable,'-stay_open','True','-@','-'],
+                         stdin=PIPE, stdout=PIPE, stderr=self.devnull)
+
+  def discard(self):
+    # closes the pipes of a process that exited or failed
+    if self.process is not None:
+      for pipe in (self.process.stdin, self.process.stdout):
+        try:
+          pipe.close()
+        except (IOError,OSError):
+          pass
+      self.process = None
+
+  def close(self):
+    with self._lock:
+      if self.process is not None and self.process.poll() is None:
+        self.process.stdin.write('-stay_open\nFalse\n')
+        self.process.stdin.flush()
+        self.process.wait()
+      self.discard()
+      if self.devnull is not None:
+        self.devnull.close()
+        self.devnull = None
+
+
+_exiftool = None
+
+def get_exiftool(executable):
+  global _exiftool
+  if _exiftool is None:
+    _exiftool = ExifTool(executable)
+  return _exiftool
@@ -0,0 +1,172 @@
+"""
+Opt-in timing of the stages of thumbnailing.
+
+When MULTIMEDIA_INSTRUMENTATION is True, each stage (open, decode, crop,
+resize, round, encode, exif, stat, media lookup, render) is timed, and
+events such as registry hits and misses are counted. Every measurement is
+sent as the measured signal and handed to the callables named in
+MULTIMEDIA_INSTRUMENTATION_SINKS, by default the in-process aggregator,
+whose summary() gives the count, p50 and p95 of each stage per format.
+
+The measurements of the current request are also available to templates
+as multimedia_stats, through the context_processor below.
+"""
+from __future__ import with_statement
+
+import threading
+import time
+from collections import deque
+
+from django.core.signals import request_started
+from django.dispatch import Signal
+
+from multimedia import settings
+
+
+# sent with stage, format (a label, see format_label) and duration (seconds, None for counters)
+measured = Signal(providing_args=['stage','format','duration'])
+
+
+class Aggregator(object):
+  "Keeps the latest durations of each (stage, format) and summarizes them."
+
+  def __init__(self, size=1000):
+    self.size    = size
+    self.samples = {} # (stage, format) -> [count, deque of the latest durations]
+    self._lock   = threading.Lock()
+
+  def __call__(self, stage, format, duration):
+    with self._lock:
+      entry = self.samples.get((stage,format))
+      if entry is None:
+        entry = self.samples[(stage,format)] = [0, deque()]
+      entry[0] += 1
+      if duration is not None:
+        entry[1].append(duration)
+        if len(entry[1]) > self.size:
+          entry[1].popleft()
+
+  def summary(self):
+    "Returns a list of dictionaries with the stage, format, count, p50 and p95 (in ms) of each stage and format."
+    with self._lock:
+      items = [(key, count, sorted(durations)) for key, (count, durations) in self.samples.items()]
+    result = []
+    for (stage, format), count, durations in sorted(items):
+      result.append({'stage': stage, 'format': format, 'count': count,
+                     'p50': percentile(durations,0.50), 'p95': percentile(durations,0.95)})
+    return result
+
+  def clear(self):
+    with self._lock:
+      self.samples.clear()
+
+
+def percentile(durations, q):
+  if not durations:
+    return None
+  return durations[int(round(q * (len(durations)-1)))] * 1000
+
+
+aggregator = Aggregator()
+
+
+class RequestStats(threading.local):
+  "Counts and total durations of the stages measured in the current request."
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.counts = {}
+    self.times  = {}
+
+  def add(self, stage, duration):
+    self.counts[stage] = self.counts.get(stage,0) + 1
+    if duration is not None:
+      self.times[stage] = self.times.get(stage,0.0) + duration
+
+  @property
+  def generated(self):
+    return self.counts.get('generate',0)
+
+  @property
+  def reused(self):
+    # thumbnails returned by Media.thumbnail() that weren't generated in this request
+    return max(self.counts.get('thumbnail',0) - self.generated, 0)
+
+  def summary(self):
+    result = []
+    for stage, count in sorted(self.counts.items()):
+      if stage in self.times:
+        result.append('%s: %d (%.1f ms)' % (stage, count, self.times[stage] * 1000))
+      else:
+        result.append('%s: %d' % (stage, count))
+    return ', '.join(result)
+
+request_stats = RequestStats()
+
+
+def reset_request_stats(sender, **kwargs):
+  request_stats.reset()
+
+request_started.connect(reset_request_stats)
+
+
+def context_processor(request):
+  "Adds multimedia_stats, the thumbnails generated and reused and the stages measured in this request."
+  return {'multimedia_stats': request_stats}
+
+
+_sinks = None
+
+def get_sinks():
+  global _sinks
+  if _sinks is None:
+    from multimedia.utilities import import_object
+    _sinks = [import_object(path) for path in settings.MULTIMEDIA_INSTRUMENTATION_SINKS]
+  return _sinks
+
+
+def format_label(format):
+  if format is None:
+    return ''
+  if isinstance(format,basestring):
+    return format
+  return format.suffix.lstrip('-')
+
+
+def record(stage, format=None, duration=None):
+  if not settings.MULTIMEDIA_INSTRUMENTATION:
+    return
+  label = format_label(format)
+  request_stats.add(stage, duration)
+  for sink in get_sinks():
+    sink(stage, label, duration)
+  measured.send(sender=None, stage=stage, format=label, duration=duration)
+
+
+def count(stage, format=None):
+  record(stage, format)
+
+
+class timer(object):
+  """
+  Times the enclosed block as a stage:
+
+    with timer('resize', format):
+      ...
+  """
+  def __init__(self, stage, format=None):
+    self.stage  = stage
+    self.format = format
+    self.start  = None
+
+  def __enter__(self):
+    if settings.MULTIMEDIA_INSTRUMENTATION:
+      self.start = time.time()
+    return self
+
+  def __exit__(self, type, value, traceback):
+    if self.start is not None and type is None:
+      record(self.stage, self.format, time.time() - self.start)
+    return False
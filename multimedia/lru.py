@@ -0,0 +1,95 @@
+"""
+A small, thread-safe LRU mapping shared by the caches in django-multimedia.
+"""
+from __future__ import with_statement
+
+import threading
+
+
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+
+class LRUCache(object):
+  "Size-bounded mapping that evicts the least recently used entry. A maxsize of 0 disables it."
+
+  def __init__(self, maxsize=128):
+    self.maxsize = maxsize
+    self.hits    = 0
+    self.misses  = 0
+    # key -> link of a circular doubly linked list, in order of use; the
+    # root's NEXT is the least recently used link, its PREV the most recent
+    self._data   = {}
+    self._root   = []
+    self._root[:] = [self._root, self._root, None, None]
+    self._lock   = threading.Lock()
+
+  def _unlink(self, link):
+    link[PREV][NEXT] = link[NEXT]
+    link[NEXT][PREV] = link[PREV]
+
+  def _append(self, link):
+    last = self._root[PREV]
+    link[PREV] = last
+    link[NEXT] = self._root
+    last[NEXT] = self._root[PREV] = link
+
+  def get(self, key, default=None):
+    with self._lock:
+      link = self._data.get(key)
+      if link is None:
+        self.misses += 1
+        return default
+      self._unlink(link)
+      self._append(link)
+      self.hits += 1
+      return link[VALUE]
+
+  def set(self, key, value):
+    if self.maxsize <= 0:
+      return
+    with self._lock:
+      link = self._data.get(key)
+      if link is not None:
+        self._unlink(link)
+        link[VALUE] = value
+      else:
+        link = self._data[key] = [None, None, key, value]
+      self._append(link)
+      while len(self._data) > self.maxsize:
+        oldest = self._root[NEXT]
+        self._unlink(oldest)
+        del self._data[oldest[KEY]]
+
+  def delete(self, key):
+    with self._lock:
+      link = self._data.pop(key, None)
+      if link is not None:
+        self._unlink(link)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+      self._root[:] = [self._root, self._root, None, None]
+      self.hits = self.misses = 0
+
+  def values(self):
+    "Returns the cached values, least recently used first."
+    with self._lock:
+      result = []
+      link = self._root[NEXT]
+      while link is not self._root:
+        result.append(link[VALUE])
+        link = link[NEXT]
+      return result
+
+  def info(self):
+    with self._lock:
+      return {'hits':self.hits, 'misses':self.misses, 'size':len(self._data), 'maxsize':self.maxsize}
+
+  def __contains__(self, key):
+    with self._lock:
+      return key in self._data
+
+  def __len__(self):
+    with self._lock:
+      return len(self._data)
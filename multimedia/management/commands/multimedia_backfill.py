@@ -0,0 +1,98 @@
+import sys
+import time
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from PIL import Image
+
+from multimedia import settings
+from multimedia.duplicates import dhash, file_hash
+from multimedia.models import HashBucket, Media, create_hash_buckets
+from multimedia.storage import get_storage
+from multimedia.utilities import make_placeholder, open_file, reduced_image
+
+
+def downscaled():
+  # images whose stored file may have been downscaled to MULTIMEDIA_MAX_DIMENSIONS:
+  # it isn't the uploaded file, so its hash wouldn't match identical uploads
+  max_width, max_height = settings.MULTIMEDIA_MAX_DIMENSIONS
+  return Q(kind='i') & (Q(width=max_width) | Q(height=max_height))
+
+
+def analyze(task):
+  # runs in a worker process; returns (media id, field values, error message)
+  id, name, kind, content_hash = task
+  try:
+    f = open_file(get_storage(),name)
+    try:
+      values = {}
+      if content_hash:
+        values['content_hash'] = file_hash(f)
+      if kind == 'i':
+        f.seek(0)
+        image = reduced_image(Image.open(f))
+        values['dhash'] = dhash(image)
+        values['dominant_color'], values['placeholder'] = make_placeholder(image)
+    finally:
+      f.close()
+    return id, values, None
+  except Exception as e:
+    return id, None, '%s: %s' % (name,e)
+
+
+@transaction.commit_on_success
+def update(results):
+  for id, values in results:
+    Media.objects.filter(id=id).update(**values)
+  HashBucket.objects.filter(media__in=[id for id, values in results]).delete()
+  create_hash_buckets([(id,values['dhash']) for id, values in results if values.get('dhash')])
+
+
+class Command(BaseCommand):
+  option_list = BaseCommand.option_list + (
+    make_option('--processes', dest='processes', type='int', default=None,
+      help='Number of worker processes (defaults to the number of CPUs).'),
+    make_option('--chunk', dest='chunk', type='int', default=500,
+      help='Number of media objects loaded from the database at a time.'),
+  )
+  help = ('Computes the content hash, difference hash, dominant color and placeholder of media saved '
+          'before they existed, without re-analyzing their files. Images downscaled to '
+          'MULTIMEDIA_MAX_DIMENSIONS keep an empty content hash.')
+
+  def handle(self, **options):
+    missing_hash = Q(content_hash='')
+    if settings.MULTIMEDIA_MAX_DIMENSIONS:
+      missing_hash &= ~downscaled()
+    queryset = Media.objects.filter(missing_hash | Q(kind='i',placeholder='')).order_by('id')
+    hashed = queryset.filter(missing_hash)
+    total = queryset.count()
+    pool = Pool(options['processes'] or cpu_count())
+    last_id = 0
+    done = failed = 0
+    start = time.time()
+    try:
+      while True:
+        rows = list(queryset.filter(id__gt=last_id).values_list('id','mediafile','kind')[:options['chunk']])
+        if not rows:
+          break
+        last_id = rows[-1][0]
+        missing = set(hashed.filter(id__in=[row[0] for row in rows]).values_list('id',flat=True))
+        tasks = [(id,name,kind,id in missing) for id, name, kind in rows]
+        results = []
+        for id, values, error in pool.imap_unordered(analyze,tasks):
+          if error:
+            failed += 1
+            sys.stderr.write('\nfailed: %s\n' % error)
+          else:
+            results.append((id,values))
+        update(results)
+        done += len(tasks)
+        elapsed = time.time() - start
+        sys.stderr.write('\r%d/%d media, %d failed, %.1f media/s ' % (done, total, failed, done / max(elapsed,0.001)))
+        sys.stderr.flush()
+    finally:
+      pool.terminate()
+    sys.stderr.write('\n')
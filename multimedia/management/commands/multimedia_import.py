@@ -0,0 +1,139 @@
+import os
+import os.path
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+
+from multimedia.models import Media, create_hash_buckets
+from multimedia.utilities import update_media
+
+
+EXTENSIONS = ('.gif','.jpg','.jpeg','.png','.tif','.tiff')
+
+
+def analyze(path):
+  """
+  Runs in a worker process: copies the file at path into the media storage
+  and analyzes it like Media.save() would. Returns (path, field values of the
+  Media object, error message).
+  """
+  mediafile = Media._meta.get_field('mediafile')
+  storage = mediafile.storage
+  name = None
+  try:
+    f = open(path,'rb')
+    try:
+      name = storage.save(mediafile.generate_filename(None,os.path.basename(path)),File(f))
+    finally:
+      f.close()
+    media = Media(mediafile=name,imported=datetime.now())
+    update_media(media)
+    values = {}
+    for field in Media._meta.fields:
+      if not field.primary_key:
+        values[field.attname] = getattr(media,field.attname)
+    values['mediafile'] = media.mediafile.name
+    return path, values, None
+  except Exception as e:
+    if name:
+      storage.delete(name) # not a file update_media() can handle
+    return path, None, '%s: %s' % (path,e)
+
+
+@transaction.commit_on_success
+def insert(objects):
+  # bulk_create skips Media.save(), which would analyze each file again
+  if hasattr(Media.objects,'bulk_create'):
+    Media.objects.bulk_create(objects)
+    names = [media.mediafile.name for media in objects]
+    hashes = Media.objects.filter(mediafile__in=names).exclude(dhash='').values_list('id','dhash')
+  else:
+    for media in objects:
+      models.Model.save(media)
+    hashes = [(media.id,media.dhash) for media in objects if media.dhash]
+  create_hash_buckets(hashes)
+
+
+class Command(BaseCommand):
+  option_list = BaseCommand.option_list + (
+    make_option('--processes', dest='processes', type='int', default=None,
+      help='Number of worker processes (defaults to the number of CPUs).'),
+    make_option('--batch', dest='batch', type='int', default=500,
+      help='Number of media objects inserted per query.'),
+    make_option('--resume', dest='resume', default=None,
+      help='File recording the paths already imported; they are skipped, and new ones are appended.'),
+    make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+      help='Only list the files that would be imported.'),
+  )
+  help = 'Imports the image files of a directory tree as media, analyzing them in several processes.'
+  args = '<directory>'
+
+  def handle(self, directory=None, **options):
+    if not directory or not os.path.isdir(directory):
+      raise CommandError('Usage: multimedia_import <directory>')
+    directory = os.path.abspath(directory)
+    resume = options['resume']
+    imported = set()
+    if resume and os.path.isfile(resume):
+      imported = set([line.rstrip('\n') for line in open(resume)])
+
+    if options['dry_run']:
+      count = 0
+      for path in self.files(directory,imported):
+        sys.stdout.write(path + '\n')
+        count += 1
+      sys.stderr.write('%d files would be imported\n' % count)
+      return
+
+    log = resume and open(resume,'a')
+    pool = Pool(options['processes'] or cpu_count())
+    done = failed = 0
+    batch = []
+    start = time.time()
+    try:
+      for path, values, error in pool.imap_unordered(analyze,self.files(directory,imported)):
+        if error:
+          failed += 1
+          sys.stderr.write('\nfailed: %s\n' % error)
+          continue
+        batch.append((path,Media(**values)))
+        if len(batch) >= options['batch']:
+          done += self.flush(batch,log)
+          batch = []
+          self.progress(done,failed,start)
+      done += self.flush(batch,log)
+      self.progress(done,failed,start)
+    finally:
+      pool.terminate()
+      if log:
+        log.close()
+    sys.stderr.write('\n')
+
+  def files(self, directory, imported):
+    # streamed in a stable order, so that runs are reproducible
+    for root, dirs, filenames in os.walk(directory):
+      dirs.sort()
+      for filename in sorted(filenames):
+        path = os.path.join(root,filename)
+        if os.path.splitext(filename)[1].lower() in EXTENSIONS and path not in imported:
+          yield path
+
+  def flush(self, batch, log):
+    if not batch:
+      return 0
+    insert([media for path,media in batch])
+    if log:
+      log.write(''.join([path + '\n' for path,media in batch]))
+      log.flush()
+    return len(batch)
+
+  def progress(self, done, failed, start):
+    elapsed = time.time() - start
+    sys.stderr.write('\r%d media imported, %d failed, %.1f media/s ' % (done, failed, done / max(elapsed,0.001)))
+    sys.stderr.flush()
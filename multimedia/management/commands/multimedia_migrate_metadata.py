@@ -0,0 +1,39 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from multimedia.models import Media
+from multimedia.utilities import metadata_fields, parse_metadata
+
+
+@transaction.commit_on_success
+def migrate(rows):
+  for id, metadata in rows:
+    Media.objects.filter(id=id).update(**metadata_fields(parse_metadata(metadata)))
+
+
+class Command(BaseCommand):
+  option_list = BaseCommand.option_list + (
+    make_option('--chunk', dest='chunk', type='int', default=1000,
+      help='Number of media objects loaded from the database at a time.'),
+  )
+  help = ('Fills the structured metadata fields (camera_make, camera_model, focal_length, iso, exif) '
+          'of media analyzed before they existed, from their metadata text.')
+
+  def handle(self, **options):
+    # rows are updated directly rather than saved, so media files aren't re-analyzed
+    queryset = Media.objects.filter(exif='').exclude(metadata='').exclude(metadata__isnull=True).order_by('id')
+    last_id = 0
+    done = 0
+    while True:
+      rows = list(queryset.filter(id__gt=last_id).values_list('id','metadata')[:options['chunk']])
+      if not rows:
+        break
+      migrate(rows)
+      last_id = rows[-1][0]
+      done += len(rows)
+      sys.stderr.write('\r%d media migrated ' % done)
+      sys.stderr.flush()
+    sys.stderr.write('\n')
@@ -0,0 +1,107 @@
+import os.path
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from multimedia import settings
+from multimedia.models import Media
+from multimedia.storage import get_storage, get_thumbnail_files
+from multimedia.utilities import compute_format, make_thumbnails, open_file
+
+
+def warm(task):
+  # runs in a worker process; returns (number of thumbnails made, error message)
+  src, jobs = task
+  try:
+    f = open_file(get_storage(),src)
+    try:
+      make_thumbnails(f,jobs,storage=get_thumbnail_files().storage)
+    finally:
+      f.close()
+    return len(jobs), None
+  except Exception as e:
+    return 0, '%s: %s' % (src,e)
+
+
+class Command(BaseCommand):
+  option_list = BaseCommand.option_list + (
+    make_option('--since', dest='since', default=None,
+      help='Only media imported on or after this date (YYYY-MM-DD).'),
+    make_option('--processes', dest='processes', type='int', default=None,
+      help='Number of worker processes (defaults to the number of CPUs).'),
+    make_option('--chunk', dest='chunk', type='int', default=500,
+      help='Number of media objects loaded from the database at a time.'),
+    make_option('--resume', dest='resume', default=None,
+      help='File recording progress; if it exists, start after the last media object it records.'),
+  )
+  help = 'Generates the missing thumbnails of all image media for the given named formats (all of them by default).'
+  args = '[named_format ...]'
+
+  def handle(self, *names, **options):
+    names = names or settings.MULTIMEDIA_FORMATS.keys()
+    formats = []
+    for name in names:
+      if not settings.MULTIMEDIA_FORMATS.has_key(name):
+        raise CommandError('Unknown named format "%s"' % name)
+      formats.append(compute_format(settings.MULTIMEDIA_FORMATS['default'],settings.MULTIMEDIA_FORMATS[name]))
+
+    queryset = Media.objects.filter(kind='i').order_by('id')
+    if options['since']:
+      try:
+        since = datetime.strptime(options['since'],'%Y-%m-%d')
+      except ValueError:
+        raise CommandError('--since must be a date of the form YYYY-MM-DD')
+      queryset = queryset.filter(imported__gte=since)
+
+    resume = options['resume']
+    last_id = 0
+    if resume and os.path.isfile(resume):
+      last_id = int(open(resume).read().strip() or 0)
+    total = queryset.filter(id__gt=last_id).count()
+
+    files = get_thumbnail_files()
+    pool = Pool(options['processes'] or cpu_count())
+    done = made = 0
+    start = time.time()
+    try:
+      while True:
+        # keyset pagination keeps memory bounded regardless of the table size
+        rows = queryset.filter(id__gt=last_id).values_list('id','mediafile','width','height')[:options['chunk']]
+        chunk = []
+        for id, name, width, height in rows.iterator():
+          last_id = id
+          media = Media(id=id,mediafile=name,width=width,height=height,kind='i')
+          chunk.append((name,[(format,media.thumbnail_name(format)) for format in formats]))
+        if not chunk:
+          break
+        count = len(chunk)
+        # checked for the whole chunk at once: one listing per thumbnail directory
+        exists = files.exists_many([dst for name,jobs in chunk for format,dst in jobs],listing=True)
+        tasks = []
+        for name, jobs in chunk:
+          jobs = [(format,dst) for format,dst in jobs if not exists[dst]]
+          if jobs:
+            tasks.append((name,jobs))
+        for n, error in pool.imap_unordered(warm,tasks):
+          made += n
+          if error:
+            sys.stderr.write('\nfailed: %s\n' % error)
+        done += count
+        if resume:
+          open(resume,'w').write('%d\n' % last_id)
+        self.progress(done,total,made,start)
+    finally:
+      pool.terminate()
+    sys.stderr.write('\n')
+
+  def progress(self, done, total, made, start):
+    elapsed = time.time() - start
+    rate = done / max(elapsed,0.001)
+    remaining = max(total-done,0) / max(rate,0.001)
+    sys.stderr.write('\r%d/%d media, %d thumbnails made, %.1f media/s, ETA %d:%02d:%02d ' %
+      (done, total, made, rate, remaining // 3600, remaining % 3600 // 60, remaining % 60))
+    sys.stderr.flush()
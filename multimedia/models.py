@@ -1,14 +1,25 @@
 import os
 import os.path
 from datetime import datetime
+from hashlib import md5
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
 
-from django.conf import settings as djangosettings
+from django.core.urlresolvers import NoReverseMatch, reverse
 from django.db import models
+from django.db.models import Q
 from PIL import Image, ImageFilter
 from tagging.fields import TagField
 
 from multimedia import settings
-from multimedia.utilities import compute_format,compute_thumbnail_dimensions,make_thumbnail,update_media
+from multimedia.duplicates import BANDS, bands, file_hash, hamming
+from multimedia.instrumentation import count
+from multimedia.registry import get_registry
+from multimedia.storage import get_storage,get_thumbnail_files
+from multimedia.utilities import Format,can_encode,compute_format,compute_thumbnail_dimensions,file_signature,thumbnail_name_re,update_media
+from multimedia.workers import generate_thumbnail,generate_thumbnails,get_queue
 
 
 MEDIA_KIND = (
@@ -18,18 +29,38 @@ MEDIA_KIND = (
 )
 
 
+def defer_metadata(queryset):
+  "Leaves the metadata text and EXIF JSON out of a listing query, on Django versions that can defer fields."
+  if hasattr(queryset,'defer'):
+    return queryset.defer('metadata','exif')
+  return queryset
+
+
 class Media(models.Model):
-  mediafile = models.FileField(upload_to=settings.MULTIMEDIA_PATH,max_length=256,blank=False)
-  kind = models.CharField(max_length=1,choices=MEDIA_KIND,blank=True)
+  mediafile = models.FileField(upload_to=settings.MULTIMEDIA_PATH,max_length=256,blank=False,storage=get_storage())
+  kind = models.CharField(max_length=1,choices=MEDIA_KIND,blank=True) # indexed with imported and id, see sql/media.sql
   caption = models.TextField(blank=True)
   tags = TagField()
   attribution_name = models.CharField(max_length=128,blank=True)
   attribution_url = models.URLField(verify_exists=False,max_length=1024,blank=True)
-  taken = models.DateTimeField('Date taken',blank=True,null=True)
-  imported = models.DateTimeField('Date imported',default=datetime.now)
+  taken = models.DateTimeField('Date taken',blank=True,null=True,db_index=True)
+  imported = models.DateTimeField('Date imported',default=datetime.now,db_index=True)
   width = models.PositiveIntegerField(default=0)
   height = models.PositiveIntegerField(default=0)
   metadata = models.TextField(blank=True,null=True)
+  # structured copies of metadata, for queries (see utilities.metadata_fields)
+  camera_make = models.CharField(max_length=64,blank=True,db_index=True,editable=False)
+  camera_model = models.CharField(max_length=64,blank=True,db_index=True,editable=False)
+  focal_length = models.FloatField(blank=True,null=True,editable=False)
+  iso = models.PositiveIntegerField(blank=True,null=True,db_index=True,editable=False)
+  exif = models.TextField(blank=True,editable=False) # JSON object of all the extracted tags
+  signature = models.CharField(max_length=64,blank=True,editable=False)
+  # SHA-1 of the file as uploaded and difference hash of the image, see duplicates.py
+  content_hash = models.CharField(max_length=40,blank=True,db_index=True,editable=False)
+  dhash = models.CharField(max_length=16,blank=True,editable=False)
+  # shown while thumbnails load or are generated, see utilities.make_placeholder
+  dominant_color = models.CharField(max_length=6,blank=True,editable=False)
+  placeholder = models.TextField(blank=True,editable=False)
 
   class Meta:
     verbose_name_plural = 'media'
@@ -39,66 +70,261 @@ class Media(models.Model):
   def __unicode__(self):
     return (self.caption or '(no caption)') + ' (id:%d)' % self.id
   
-  def save(self):
-    try:
-      update_media(self)
-    finally:
-      super(Media, self).save()
+  def __init__(self,*args,**kwargs):
+    super(Media, self).__init__(*args,**kwargs)
+    # the name of the media file as last saved, used to detect new uploads
+    self._saved_mediafile = self.id and self.mediafile.name or None
+
+  def save(self,*args,**kwargs):
+    # metadata-only changes (caption, tags, ...) don't touch the media file
+    if self.mediafile_changed():
+      try:
+        uploaded = self.mediafile.name != self._saved_mediafile
+        f = self.mediafile.storage.open(self.mediafile.name,'rb')
+        try:
+          content_hash = file_hash(f)
+        finally:
+          f.close()
+        original = uploaded and settings.MULTIMEDIA_DEDUPE and self.find_original(content_hash)
+        if original:
+          self.reuse_file(original)
+        else:
+          update_media(self,content_hash)
+      finally:
+        get_registry().invalidate(self)
+        super(Media, self).save(*args,**kwargs)
+      self.update_hash_buckets()
+    else:
+      super(Media, self).save(*args,**kwargs)
+    self._saved_mediafile = self.mediafile.name
+
+  def mediafile_changed(self):
+    "True if a new file was assigned since this object was loaded, or if the file was never analyzed."
+    return self.mediafile.name != self._saved_mediafile or not self.signature
+
+  def find_original(self,content_hash):
+    "Returns another media object whose file was uploaded with the given content hash, if any."
+    originals = Media.objects.filter(content_hash=content_hash).exclude(mediafile=self.mediafile.name)
+    if self.id is not None:
+      originals = originals.exclude(id=self.id)
+    originals = list(originals.order_by('id')[:1])
+    return originals and originals[0] or None
+
+  def reuse_file(self,original):
+    """
+    Points this media object at the file of original, an identical upload,
+    and copies what was extracted from it instead of analyzing the new copy,
+    which is deleted. Thumbnails stored next to the file are shared too.
+    """
+    uploaded = self.mediafile.name
+    if not Media.objects.filter(mediafile=uploaded).exclude(id=self.id).count():
+      self.mediafile.storage.delete(uploaded)
+    self.mediafile.name = original.mediafile.name
+    for field in ANALYZED_FIELDS:
+      setattr(self,field,getattr(original,field))
+
+  def duplicates(self):
+    "Returns the other media objects whose file was uploaded with the same content."
+    if not self.content_hash:
+      return Media.objects.none()
+    return Media.objects.filter(content_hash=self.content_hash).exclude(id=self.id)
+
+  def similar_media(self,max_distance=BANDS-1):
+    """
+    Returns the other images whose difference hash differs from this one's in
+    at most max_distance bits (at most BANDS-1, see duplicates.py), as a list
+    of (distance, media) pairs, closest first.
+    """
+    if not self.dhash:
+      return []
+    query = Q()
+    for band, value in bands(self.dhash):
+      query |= Q(band=band,value=value)
+    ids = set(HashBucket.objects.filter(query).exclude(media=self.id).values_list('media',flat=True))
+    result = []
+    for media in defer_metadata(Media.objects.filter(id__in=list(ids))):
+      distance = hamming(self.dhash,media.dhash)
+      if distance <= max_distance:
+        result.append((distance,media))
+    result.sort(key=lambda item: (item[0],item[1].id))
+    return result
+
+  def update_hash_buckets(self):
+    HashBucket.objects.filter(media=self.id).delete()
+    if self.dhash:
+      create_hash_buckets([(self.id,self.dhash)])
+
+  def refresh_media(self):
+    """
+    Re-analyzes the media file and saves this object if the file was modified
+    in place since it was last analyzed (according to its size and mtime).
+    Returns True if it was.
+    """
+    if file_signature(self.mediafile.storage,self.mediafile.name) == self.signature:
+      return False
+    self.signature = ''
+    self.save()
+    return True
     
   def delete(self):
     try:
-      from glob import glob
-      pattern = os.path.join(djangosettings.MEDIA_ROOT,self.thumbnail_glob())
-      for f in glob(pattern):
-        os.remove(f)
+      get_registry().invalidate(self)
+      self.delete_thumbnails()
     finally:
       super(Media, self).delete()
     
+  @property
+  def exif_tags(self):
+    "The extracted EXIF tags, as a dictionary."
+    return self.exif and json.loads(self.exif) or {}
+
   def get_media_url(self):
     return self.mediafile.url
     
   def admin_thumbnail(self):
-    return self.thumbnail(settings.MULTIMEDIA_FORMATS['admin'])
+    return self.lazy_thumbnail('admin')
+
+  def lazy_thumbnail(self,format_name):
+    """
+    Returns the thumbnail of a named format without generating it: if it
+    doesn't exist yet, its url is that of the thumbnail view, which generates
+    it when the browser first requests it. Without multimedia.urls, it is
+    queued for generation in the background and returned as pending instead.
+    """
+    if self.kind != 'i':
+      return None
+    f = compute_format(settings.MULTIMEDIA_FORMATS['default'],settings.MULTIMEDIA_FORMATS[format_name])
+    registry = get_registry()
+    entry = registry.get(self,f)
+    if entry is None:
+      name = self.thumbnail_name(f)
+      width, height = compute_thumbnail_dimensions((self.width,self.height), f)
+      if not get_thumbnail_files().exists(name):
+        try:
+          url = reverse('multimedia-thumbnail',args=(self.id,format_name))
+        except NoReverseMatch:
+          queue = get_queue()
+          queue.enqueue(self.mediafile.name,f,name)
+          if queue.failed(name):
+            return None
+          url = self.placeholder or settings.MULTIMEDIA_THUMBNAIL_PLACEHOLDER
+          return Thumbnail(self,f,url,width,height,pending=True)
+        return Thumbnail(self,f,url,width,height)
+      entry = (name,get_thumbnail_files().storage.url(name),width,height)
+      registry.set(self,f,entry)
+    name, url, width, height = entry
+    return Thumbnail(self,f,url,width,height)
+
+  def regenerate_thumbnails(self,format_names=None):
+    """
+    Deletes the thumbnails of this media and queues those of the given named
+    formats (all of them by default) for generation in the background.
+    """
+    get_registry().invalidate(self)
+    self.delete_thumbnails()
+    if self.kind != 'i':
+      return
+    queue = get_queue()
+    for format_name in format_names or settings.MULTIMEDIA_FORMATS.keys():
+      f = compute_format(settings.MULTIMEDIA_FORMATS['default'],settings.MULTIMEDIA_FORMATS[format_name])
+      queue.enqueue(self.mediafile.name,f,self.thumbnail_name(f),retry=True)
 
   def thumbnail(self,format=None):
     f = compute_format(settings.MULTIMEDIA_FORMATS['default'],format)
-    name = self.create_thumbnail(f)
-    if name:
-      url = os.path.join(djangosettings.MEDIA_URL,name)
+    registry = get_registry()
+    entry = registry.get(self,f)
+    count(entry is None and 'registry_miss' or 'registry_hit', f)
+    if entry is None:
+      background = settings.MULTIMEDIA_THUMBNAIL_ASYNC
+      name = self.create_thumbnail(f,background)
       width, height = compute_thumbnail_dimensions((self.width,self.height), f)
-      return Thumbnail(self,f,url,width,height)
-    else:
-      return None
+      if not name:
+        if background and self.kind == 'i' and not get_queue().failed(self.thumbnail_name(f)):
+          # being generated; render a placeholder of the right size meanwhile
+          url = self.placeholder or settings.MULTIMEDIA_THUMBNAIL_PLACEHOLDER
+          return Thumbnail(self,f,url,width,height,pending=True)
+        return None
+      url = get_thumbnail_files().storage.url(name)
+      entry = (name,url,width,height)
+      registry.set(self,f,entry)
+    name, url, width, height = entry
+    count('thumbnail', f)
+    return Thumbnail(self,f,url,width,height)
+
+  def create_thumbnails(self,formats):
+    """
+    Returns the thumbnails of several formats, like thumbnail(), generating
+    the missing ones with a single decode of the media file. If
+    MULTIMEDIA_THUMBNAIL_ASYNC is set, they are queued instead, and returned
+    as pending thumbnails.
+    """
+    formats = [compute_format(settings.MULTIMEDIA_FORMATS['default'],f) for f in formats]
+    if self.kind == 'i':
+      registry = get_registry()
+      jobs = [(f,self.thumbnail_name(f)) for f in formats if registry.get(self,f) is None]
+      # a per-media thumbnail directory is listed once rather than asked about each thumbnail
+      exists = get_thumbnail_files().exists_many([name for f,name in jobs],listing=bool(self.thumbnail_dir()))
+      jobs = [(f,name) for f,name in jobs if not exists[name]]
+      if jobs and not settings.MULTIMEDIA_THUMBNAIL_ASYNC:
+        try:
+          generate_thumbnails(self.mediafile.name,jobs)
+        except IOError:
+          return [None for f in formats]
+    return [self.thumbnail(f) for f in formats]
 
   def thumbnail_name(self,format):
     # like self.mediafile.name except that the filename is replaced with
-    # a string of the form "tn-<basename>-200x200-sq-rd10-bgff0000.<ext>"
+    # a string of the form "tn-<basename>-200x200-sq-rd10-bgff0000.<ext>",
+    # and the directory with thumbnail_dir() if MULTIMEDIA_THUMBNAIL_ROOT is set
+    if not isinstance(format,Format):
+      format = compute_format(format)
     head, tail = os.path.split(self.mediafile.name)
     basename, ext = os.path.splitext(tail)
-    width, height = format['dimensions']
-    s = 'tn-%s-%sx%s' % (basename,width,height)
-    if format['square']:
-      s += "-sq"
-    if format['round'] != 0:
-      s += "-rd" + str(format['round'])
-    if format['bg'] != 'ffffff':
-      s += '-bg' + format['bg']
-    s += ext.lower()
-    return os.path.join(head,s)
-    
-  def thumbnail_glob(self):
+    return os.path.join(self.thumbnail_dir() or head,'tn-%s%s%s' % (basename,format.suffix,format.extension(ext)))
+
+  def thumbnail_dir(self):
+    """
+    Returns the directory holding only this media's thumbnails, of the form
+    "<MULTIMEDIA_THUMBNAIL_ROOT>/3c/59/42", or None if thumbnails are stored
+    next to the media file.
+    """
+    if not settings.MULTIMEDIA_THUMBNAIL_ROOT or self.id is None:
+      return None
+    shard = md5(str(self.id)).hexdigest()
+    return os.path.join(settings.MULTIMEDIA_THUMBNAIL_ROOT,shard[:2],shard[2:4],str(self.id))
+
+  def delete_thumbnails(self):
+    files = get_thumbnail_files()
+    directory = self.thumbnail_dir()
+    if directory:
+      files.delete_directory(directory)
+      return
+    # thumbnails are next to the media file; match their exact names, since
+    # other media files may share this one's basename as a prefix
+    if Media.objects.filter(mediafile=self.mediafile.name).exclude(id=self.id).count():
+      return # the file and its thumbnails are shared with a duplicate (see reuse_file)
     head, tail = os.path.split(self.mediafile.name)
     basename, ext = os.path.splitext(tail)
-    s = 'tn-%s-*%s' % (basename,ext.lower())
-    return os.path.join(head,s)
+    pattern = thumbnail_name_re(basename)
+    try:
+      filenames = files.storage.listdir(head)[1]
+    except (OSError,NotImplementedError):
+      return
+    for filename in filenames:
+      if pattern.match(filename):
+        files.delete(os.path.join(head,filename))
 
-  def create_thumbnail(self,format):
+  def create_thumbnail(self,format,background=False):
+    # returns None if the thumbnail can't be generated or, when background is
+    # True, if it has been queued for generation (or recently failed to generate)
     if self.kind == 'i':
       name = self.thumbnail_name(format)
-      filepath = os.path.join(djangosettings.MEDIA_ROOT,name)
-      if not os.path.isfile(filepath):
+      if not get_thumbnail_files().exists(name):
+        if background:
+          get_queue().enqueue(self.mediafile.name,format,name)
+          return None
         try:
-          make_thumbnail(self.mediafile.path,format,filepath)
+          generate_thumbnail(self.mediafile.name,format,name)
         except IOError:
           return None
       return name
@@ -106,13 +332,66 @@ class Media(models.Model):
       return None
 
 
+# the fields set by update_media, copied by Media.reuse_file
+ANALYZED_FIELDS = ('kind','width','height','taken','metadata','camera_make','camera_model','focal_length','iso','exif',
+                   'signature','content_hash','dhash','dominant_color','placeholder')
+
+
+class HashBucket(models.Model):
+  "A 16 bit band of the difference hash of a media object (see duplicates.py)."
+  media = models.ForeignKey(Media,related_name='hash_buckets')
+  band = models.PositiveSmallIntegerField()
+  value = models.PositiveIntegerField() # indexed with band, see sql/hashbucket.sql
+
+
+def create_hash_buckets(hashes):
+  "Indexes the difference hashes of media objects, given as (media id, dhash) pairs."
+  buckets = [HashBucket(media_id=id,band=band,value=value) for id, hash in hashes for band, value in bands(hash)]
+  if hasattr(HashBucket.objects,'bulk_create'):
+    HashBucket.objects.bulk_create(buckets)
+  else:
+    for bucket in buckets:
+      bucket.save()
+
+
 class Thumbnail(object):
-  def __init__(self,media,format,url,width,height):
-    self.media  = media
-    self.format = format
-    self.url    = url
-    self.width  = width
-    self.height = height
+  def __init__(self,media,format,url,width,height,pending=False):
+    self.media   = media
+    self.format  = format
+    self.url     = url
+    self.width   = width
+    self.height  = height
+    self.pending = pending
+    self.variants = [] # (thumbnail, density descriptor) pairs, see the thumbnail_srcset tag
+
+  def alternate(self,type):
+    "Returns this thumbnail encoded as another type (e.g. 'webp'), or None if PIL can't encode that type."
+    if not can_encode(type):
+      return None
+    return self.media.thumbnail(compute_format(self.format,'type='+type))
+
+  @property
+  def color(self):
+    "The dominant color of the media, as 'rrggbb' (empty if unknown)."
+    return self.media.dominant_color
+
+  @property
+  def placeholder(self):
+    "A tiny blurred preview of the media, as a data URI (empty if unknown)."
+    return self.media.placeholder
+
+  @property
+  def relative(self):
+    "True if url is relative to the site (rather than a placeholder or a remote storage's url)."
+    return self.url.startswith('/')
+
+  @property
+  def webp(self):
+    return self.alternate('webp')
+
+  @property
+  def srcset(self):
+    return ', '.join(['%s %s' % (thumbnail.url,density) for thumbnail,density in self.variants])
 
   def as_img_tag(self):
     return '<img src="%s" width="%d" height="%d"/>' % (self.url, self.width, self.height)
@@ -0,0 +1,89 @@
+"""
+Registry of generated thumbnails.
+
+Remembers, per Media object, the name, url and dimensions of every thumbnail
+that has been generated so that rendering a known thumbnail needs neither a
+stat() on MEDIA_ROOT nor a dimension computation. Entries live in an
+in-process LRU and, optionally, in Django's cache backend so that they are
+shared between processes.
+
+Entries are keyed by (mediafile name, width, height, format), so a media
+object whose file or dimensions change never sees a stale entry, and are
+dropped explicitly by Media.save() and Media.delete().
+"""
+
+from multimedia import settings
+from multimedia.lru import LRUCache
+from multimedia.utilities import format_key, import_object
+
+
+class ThumbnailRegistry(object):
+  def __init__(self, size=None, use_cache_backend=None, timeout=None):
+    if size is None:
+      size = settings.MULTIMEDIA_THUMBNAIL_CACHE_SIZE
+    if use_cache_backend is None:
+      use_cache_backend = settings.MULTIMEDIA_THUMBNAIL_CACHE_BACKEND
+    if timeout is None:
+      timeout = settings.MULTIMEDIA_THUMBNAIL_CACHE_TIMEOUT
+    self.local   = LRUCache(size)
+    self.timeout = timeout
+    if use_cache_backend:
+      from django.core.cache import cache
+      self.backend = cache
+    else:
+      self.backend = None
+
+  def get(self, media, format):
+    "Returns a (name, url, width, height) tuple, or None if the thumbnail is not known."
+    if media.id is None:
+      return None
+    entries = self.local.get(media.id)
+    if entries is None and self.backend is not None:
+      entries = self.backend.get(self.backend_key(media.id))
+      if entries is not None:
+        self.local.set(media.id, entries)
+    if entries:
+      return entries.get(self.key(media, format))
+    return None
+
+  def set(self, media, format, entry):
+    if media.id is None:
+      return
+    entries = dict(self.local.get(media.id) or {})
+    if self.backend is not None:
+      # merged, so that the entries other processes set for this media are kept
+      entries.update(self.backend.get(self.backend_key(media.id)) or {})
+    entries[self.key(media, format)] = tuple(entry)
+    self.local.set(media.id, entries)
+    if self.backend is not None:
+      if self.timeout:
+        self.backend.set(self.backend_key(media.id), entries, self.timeout)
+      else:
+        self.backend.set(self.backend_key(media.id), entries)
+
+  def invalidate(self, media):
+    if media.id is None:
+      return
+    self.local.delete(media.id)
+    if self.backend is not None:
+      self.backend.delete(self.backend_key(media.id))
+
+  def clear(self):
+    "Clears the in-process entries (entries in the cache backend expire on their own)."
+    self.local.clear()
+
+  def key(self, media, format):
+    return (media.mediafile.name, media.width, media.height, format_key(format))
+
+  def backend_key(self, media_id):
+    return 'multimedia.thumbnails.%d' % media_id
+
+
+_registry = None
+
+def get_registry():
+  "Returns the registry configured by MULTIMEDIA_THUMBNAIL_REGISTRY."
+  global _registry
+  if _registry is None:
+    _registry = import_object(settings.MULTIMEDIA_THUMBNAIL_REGISTRY)()
+  return _registry
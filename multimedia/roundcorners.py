@@ -1,4 +1,6 @@
-from PIL import Image, ImageDraw, ImageChops
+from PIL import Image, ImageDraw
+
+from multimedia.lru import LRUCache
 
 # Rounded corners
 # (c) 2008 www.stani.be
@@ -16,15 +18,71 @@ CROSS_POS               = (CROSS,CROSS,CROSS,CROSS)
 ROUNDED_POS             = (ROUNDED,ROUNDED,ROUNDED,ROUNDED)
 ROUNDED_RECTANGLE_ID    = 'rounded_rectangle_r%d_f%d_s%s_p%s'
 
-def round_image(image,cache={},radius=100,fill=255,pos=ROUNDED_POS,bg_color='#FFFFFF'):
+# corner masks and background tiles, keyed by (radius, fill, pos, bg_color)
+corner_cache            = LRUCache(64)
+
+def round_image(image,cache=None,radius=100,fill=255,pos=ROUNDED_POS,bg_color='#FFFFFF'):
+   """Rounds the corners of image, filling the space outside the corners with
+   bg_color and making it transparent. Only the four corner tiles are
+   composited. The cache argument is ignored; it is kept for compatibility."""
    if image.mode != 'RGBA':
        image = image.convert('RGBA')
-   mask = create_rounded_rectangle(image.size,cache,radius,fill,pos)
-   image.paste(Image.new('RGB',image.size,bg_color),(0,0),
-       ImageChops.invert(mask))
-   image.putalpha(mask)
+       if fill != 255:
+           image.putalpha(fill)
+   else:
+       # like the mask of create_rounded_rectangle, the inside gets alpha=fill
+       image.putalpha(fill)
+   im_x, im_y  = image.size
+   radius      = min(radius,im_x//2,im_y//2)
+   if radius <= 0:
+       return image
+   masks, background = get_corners(radius,fill,pos,bg_color)
+   for index, mask in enumerate(masks):
+       if mask is None:
+           continue
+       if index%2:
+           x       = im_x-radius
+       else:
+           x       = 0
+       if index < 2:
+           y       = 0
+       else:
+           y       = im_y-radius
+       box     = (x,y,x+radius,y+radius)
+       tile    = Image.composite(image.crop(box),background,mask)
+       tile.putalpha(mask)
+       image.paste(tile,box)
    return image
 
+def get_corners(radius=100,fill=255,pos=ROUNDED_POS,bg_color='#FFFFFF'):
+   """Returns the masks of the four corners (top left, top right, bottom left,
+   bottom right; None for square corners) and a background tile."""
+   key     = (radius,fill,pos,bg_color)
+   corners = corner_cache.get(key)
+   if corners is None:
+       corner  = create_corner(radius,fill)
+       cross   = Image.new('L',(radius,radius),0)
+       masks   = []
+       cut     = False
+       for index, angle in enumerate(pos):
+           # like create_rounded_rectangle, corners from a cross on are cut out
+           cut     = cut or angle == CROSS
+           if cut:
+               masks.append(cross)
+               continue
+           if angle != ROUNDED:
+               masks.append(None)
+               continue
+           element = corner
+           if index%2:
+               element = element.transpose(Image.FLIP_LEFT_RIGHT)
+           if index >= 2:
+               element = element.transpose(Image.FLIP_TOP_BOTTOM)
+           masks.append(element)
+       corners = (masks,Image.new('RGBA',(radius,radius),bg_color))
+       corner_cache.set(key,corners)
+   return corners
+
 def create_corner(radius=100,fill=255,factor=2):
    corner  = Image.new('L',(factor*radius,factor*radius),0)
    draw    = ImageDraw.Draw(corner)
@@ -32,7 +90,11 @@ def create_corner(radius=100,fill=255,factor=2):
    corner  = corner.resize((radius,radius),Image.ANTIALIAS)
    return corner
 
-def create_rounded_rectangle(size=(600,400),cache={},radius=100,fill=255,pos=ROUNDED_POS):
+def create_rounded_rectangle(size=(600,400),cache=None,radius=100,fill=255,pos=ROUNDED_POS):
+   """Returns a full-size mask of a rounded rectangle. It is no longer used by
+   round_image; pass a cache (a dictionary) to keep the masks between calls."""
+   if cache is None:
+       cache   = {}
    #rounded_rectangle
    im_x, im_y  = size
    rounded_rectangle_id    = ROUNDED_RECTANGLE_ID%(radius,fill,size,pos)
@@ -18,3 +18,106 @@ MULTIMEDIA_PATH = \
 
 MULTIMEDIA_MAX_DIMENSIONS = \
   getattr(settings,'MULTIMEDIA_MAX_DIMENSIONS',None)
+
+# registry of generated thumbnails (see multimedia/registry.py)
+MULTIMEDIA_THUMBNAIL_REGISTRY = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_REGISTRY','multimedia.registry.ThumbnailRegistry')
+
+# number of media objects whose thumbnails are remembered in-process (0 disables)
+MULTIMEDIA_THUMBNAIL_CACHE_SIZE = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_CACHE_SIZE',1000)
+
+# also share the registry between processes through Django's cache backend
+MULTIMEDIA_THUMBNAIL_CACHE_BACKEND = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_CACHE_BACKEND',False)
+
+# timeout (in seconds) of registry entries in the cache backend (None uses the backend default)
+MULTIMEDIA_THUMBNAIL_CACHE_TIMEOUT = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_CACHE_TIMEOUT',None)
+
+# generate missing thumbnails in background threads, rendering a placeholder meanwhile
+MULTIMEDIA_THUMBNAIL_ASYNC = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_ASYNC',False)
+
+# number of background threads generating thumbnails
+MULTIMEDIA_THUMBNAIL_WORKERS = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_WORKERS',2)
+
+# directory of job files used to deduplicate queued thumbnails across processes (None disables)
+MULTIMEDIA_THUMBNAIL_QUEUE_DIR = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_QUEUE_DIR',None)
+
+# seconds after which a job file is considered abandoned and its job retried
+MULTIMEDIA_THUMBNAIL_QUEUE_TIMEOUT = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_QUEUE_TIMEOUT',300)
+
+# seconds during which a thumbnail that failed to generate in the background isn't queued again
+MULTIMEDIA_THUMBNAIL_FAILURE_TIMEOUT = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_FAILURE_TIMEOUT',600)
+
+# url rendered in place of a thumbnail that is still being generated (a transparent GIF)
+MULTIMEDIA_THUMBNAIL_PLACEHOLDER = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_PLACEHOLDER',
+    'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+# exiftool executable used for files whose metadata PIL can't read (None disables it)
+MULTIMEDIA_EXIFTOOL = \
+  getattr(settings,'MULTIMEDIA_EXIFTOOL','exiftool')
+
+# number of compiled templates cached by render_multimedia_tags, and of thumbnail templates
+MULTIMEDIA_TEMPLATE_CACHE_SIZE = \
+  getattr(settings,'MULTIMEDIA_TEMPLATE_CACHE_SIZE',200)
+
+# maximum number of oversized originals downscaled at the same time (per process)
+MULTIMEDIA_MAX_CONCURRENT_DECODES = \
+  getattr(settings,'MULTIMEDIA_MAX_CONCURRENT_DECODES',2)
+
+# directory (relative to MEDIA_ROOT) under which thumbnails are stored, in a
+# directory per media object sharded by a hash of its id; None stores them
+# next to the media files
+MULTIMEDIA_THUMBNAIL_ROOT = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_ROOT',None)
+
+# dotted path of the Storage class holding media files (None uses Django's default storage)
+MULTIMEDIA_STORAGE = \
+  getattr(settings,'MULTIMEDIA_STORAGE',None)
+
+# dotted path of the Storage class holding thumbnails (None uses MULTIMEDIA_STORAGE)
+MULTIMEDIA_THUMBNAIL_STORAGE = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_STORAGE',None)
+
+# seconds during which a thumbnail found in storage is assumed to still exist, and how many are remembered
+MULTIMEDIA_STORAGE_CACHE_TIMEOUT = \
+  getattr(settings,'MULTIMEDIA_STORAGE_CACHE_TIMEOUT',3600)
+MULTIMEDIA_STORAGE_CACHE_SIZE = \
+  getattr(settings,'MULTIMEDIA_STORAGE_CACHE_SIZE',10000)
+
+# Cache-Control header of thumbnails served by the thumbnail view (None omits it)
+MULTIMEDIA_THUMBNAIL_CACHE_CONTROL = \
+  getattr(settings,'MULTIMEDIA_THUMBNAIL_CACHE_CONTROL','public, max-age=86400')
+
+# header with which the thumbnail view hands files to the web server instead of
+# sending them itself: 'X-Sendfile' (Apache, lighttpd) or 'X-Accel-Redirect' (nginx)
+MULTIMEDIA_SENDFILE_HEADER = \
+  getattr(settings,'MULTIMEDIA_SENDFILE_HEADER',None)
+
+# internal nginx location under which X-Accel-Redirect finds the thumbnail storage's files
+MULTIMEDIA_SENDFILE_ROOT = \
+  getattr(settings,'MULTIMEDIA_SENDFILE_ROOT','/protected/')
+
+# time the stages of thumbnailing (see multimedia/instrumentation.py)
+MULTIMEDIA_INSTRUMENTATION = \
+  getattr(settings,'MULTIMEDIA_INSTRUMENTATION',False)
+
+# dotted paths of the callables measurements are handed to, as (stage, format, duration)
+MULTIMEDIA_INSTRUMENTATION_SINKS = \
+  getattr(settings,'MULTIMEDIA_INSTRUMENTATION_SINKS',('multimedia.instrumentation.aggregator',))
+
+# when a file identical to an existing media's is uploaded, reuse that media's file
+# (and thumbnails stored next to it) instead of analyzing the new copy
+MULTIMEDIA_DEDUPE = \
+  getattr(settings,'MULTIMEDIA_DEDUPE',False)
+
+# maximum width and height of the blurred preview stored with each image
+MULTIMEDIA_PLACEHOLDER_SIZE = \
+  getattr(settings,'MULTIMEDIA_PLACEHOLDER_SIZE',16)
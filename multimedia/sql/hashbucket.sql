@@ -0,0 +1,2 @@
+-- Near duplicates are looked up by (band, value), see multimedia/duplicates.py.
+CREATE INDEX multimedia_hashbucket_band_value ON multimedia_hashbucket (band, value);
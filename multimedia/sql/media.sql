@@ -0,0 +1,3 @@
+-- Composite index for the listing queries, run by syncdb after creating the
+-- multimedia_media table. multimedia_warm walks the media of a kind by id.
+CREATE INDEX multimedia_media_kind_id ON multimedia_media (kind, id);
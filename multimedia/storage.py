@@ -0,0 +1,144 @@
+"""
+Access to the storages holding media files and thumbnails.
+
+Media files are stored in MULTIMEDIA_STORAGE and thumbnails in
+MULTIMEDIA_THUMBNAIL_STORAGE (both dotted paths of Django Storage classes,
+defaulting to Django's default storage), so they may live in a remote
+object store. All file access goes through the Storage API.
+
+Since asking a remote storage whether a file exists may take a round trip,
+thumbnails known to exist are remembered for MULTIMEDIA_STORAGE_CACHE_TIMEOUT
+seconds, and exists_many() can check a large batch of thumbnails with one
+listing per directory.
+"""
+from __future__ import with_statement
+
+import os.path
+import shutil
+import time
+
+from django.core.files.storage import default_storage
+
+from multimedia import settings
+from multimedia.instrumentation import timer
+from multimedia.lru import LRUCache
+from multimedia.utilities import import_object, local_path
+
+
+class ExistenceCache(object):
+  "Remembers which files of a storage are known to exist."
+
+  def __init__(self, storage, size=None, timeout=None):
+    if size is None:
+      size = settings.MULTIMEDIA_STORAGE_CACHE_SIZE
+    if timeout is None:
+      timeout = settings.MULTIMEDIA_STORAGE_CACHE_TIMEOUT
+    self.storage = storage
+    self.timeout = timeout
+    self.files   = LRUCache(size) # name -> time until which it is known to exist
+
+  def exists(self, name):
+    if self.known(name):
+      return True
+    with timer('stat'):
+      exists = self.storage.exists(name)
+    if exists:
+      self.add(name)
+      return True
+    return False
+
+  def exists_many(self, names, listing=False):
+    """
+    Returns a dictionary telling which of the given files exist. With listing,
+    each directory holding several of them is listed once instead; this only
+    pays off when the names make up most of the directory (a large batch, or
+    the per-media thumbnail directories of MULTIMEDIA_THUMBNAIL_ROOT).
+    """
+    result = {}
+    directories = {}
+    for name in names:
+      if self.known(name):
+        result[name] = True
+      else:
+        directories.setdefault(os.path.dirname(name),[]).append(name)
+    for directory, names in directories.items():
+      filenames = None
+      if listing and len(names) > 1:
+        try:
+          with timer('stat'):
+            filenames = set(self.storage.listdir(directory)[1])
+        except OSError:
+          filenames = set() # the directory doesn't exist (yet)
+        except NotImplementedError:
+          pass # the storage can't list, ask for each file
+      for name in names:
+        if filenames is None:
+          with timer('stat'):
+            exists = self.storage.exists(name)
+        else:
+          exists = os.path.basename(name) in filenames
+        if exists:
+          self.add(name)
+        result[name] = exists
+    return result
+
+  def known(self, name):
+    expires = self.files.get(name)
+    return expires is not None and expires > time.time()
+
+  def add(self, name):
+    self.files.set(name, time.time() + self.timeout)
+
+  def discard(self, name):
+    self.files.delete(name)
+
+  def delete(self, name):
+    self.discard(name)
+    self.storage.delete(name)
+
+  def delete_directory(self, directory):
+    "Deletes a directory of thumbnails and the files in it."
+    path = local_path(self.storage, directory)
+    try:
+      dirs, filenames = self.storage.listdir(directory)
+    except (OSError,NotImplementedError):
+      return
+    for filename in filenames:
+      self.discard(os.path.join(directory,filename))
+    if path:
+      shutil.rmtree(path,True)
+    else:
+      for filename in filenames:
+        self.storage.delete(os.path.join(directory,filename))
+
+
+_storage = None
+
+def get_storage():
+  "Returns the storage of media files."
+  global _storage
+  if _storage is None:
+    if settings.MULTIMEDIA_STORAGE:
+      _storage = import_object(settings.MULTIMEDIA_STORAGE)()
+    else:
+      _storage = default_storage
+  return _storage
+
+
+_thumbnail_files = None
+
+def get_thumbnail_files():
+  "Returns the ExistenceCache of the storage of thumbnails (see its storage attribute)."
+  global _thumbnail_files
+  if _thumbnail_files is None:
+    if settings.MULTIMEDIA_THUMBNAIL_STORAGE:
+      storage = import_object(settings.MULTIMEDIA_THUMBNAIL_STORAGE)()
+    else:
+      storage = get_storage()
+    _thumbnail_files = ExistenceCache(storage)
+  return _thumbnail_files
+
+
+def get_thumbnail_storage():
+  "Returns the storage of thumbnails."
+  return get_thumbnail_files().storage
@@ -1,5 +1,8 @@
+from __future__ import with_statement
+
 import re
 import string
+from hashlib import md5
 from types import IntType, LongType, StringType, UnicodeType
 
 from django.contrib.sites.models import Site
@@ -8,14 +11,91 @@ from django.template import Context, Library, loader, Node, Template, TemplateSy
 from django.utils.translation import ugettext as _
 
 from multimedia import settings
-from multimedia.models import Media
-from multimedia.utilities import parse_format
+from multimedia.instrumentation import timer
+from multimedia.lru import LRUCache
+from multimedia.models import Media, defer_metadata
+from multimedia.utilities import compute_format, compute_thumbnail_dimensions, parse_format, scale_format
 from tagging.models import Tag, TaggedItem
 from tagging.utils import parse_tag_input
 
 
 register = Library()
 
+# compiled templates of the render_multimedia_tags filter, keyed by a hash of their source
+tags_templates = LRUCache(settings.MULTIMEDIA_TEMPLATE_CACHE_SIZE)
+
+# templates used to render thumbnails, keyed by name
+thumbnail_templates = LRUCache(settings.MULTIMEDIA_TEMPLATE_CACHE_SIZE)
+
+
+def get_thumbnail_template(name):
+  template = thumbnail_templates.get(name)
+  if template is None:
+    template = loader.get_template(name)
+    thumbnail_templates.set(name, template)
+  return template
+
+
+def template_cache_info():
+  "Returns the hits, misses and sizes of the template caches."
+  return {'render_multimedia_tags':tags_templates.info(), 'thumbnail':thumbnail_templates.info()}
+
+
+RENDER_CACHE = '_multimedia_render_cache'
+
+def render_cache(context):
+  """
+  Returns a dictionary that lives as long as the outermost render of context,
+  used to share media objects and the current Site between thumbnail tags.
+  """
+  for d in context.dicts:
+    if d.has_key(RENDER_CACHE):
+      return d[RENDER_CACHE]
+  # Django 1.2+ pushes new scopes at the end of context.dicts, older versions at the front
+  if hasattr(context,'render_context'):
+    base = context.dicts[0]
+  else:
+    base = context.dicts[-1]
+  cache = base[RENDER_CACHE] = {'media':{}, 'site':None}
+  return cache
+
+
+def get_media(context, id):
+  "Returns the Media object with the given id, fetching it unless it was prefetched."
+  media = render_cache(context)['media']
+  if not media.has_key(id):
+    try:
+      with timer('media_lookup'):
+        media[id] = Media.objects.get(id=id)
+    except ObjectDoesNotExist:
+      media[id] = None
+  if media[id] is None:
+    raise Media.DoesNotExist
+  return media[id]
+
+
+def prefetch_media(context, ids):
+  "Fetches the Media objects with the given ids, with a single query, for the thumbnail tags rendered in context."
+  media = render_cache(context)['media']
+  ids = [id for id in set(ids) if not media.has_key(id)]
+  if ids:
+    with timer('media_lookup'):
+      found = Media.objects.in_bulk(ids)
+    for id in ids:
+      media[id] = found.get(id)
+
+
+def media_ids(nodelist):
+  "Returns the literal media ids referred to by the thumbnail tags in nodelist."
+  return [int(node.var_or_id) for node in nodelist.get_nodes_by_type(ThumbnailNode) if node.var_or_id.isdigit()]
+
+
+def get_site(context):
+  cache = render_cache(context)
+  if cache['site'] is None:
+    cache['site'] = Site.objects.get_current()
+  return cache['site']
+
 
 class ThumbnailNode(Node):
   def __init__(self, var_or_id, context_var=None, format=None, **extra):
@@ -25,6 +105,10 @@ class ThumbnailNode(Node):
     self.extra       = extra
 
   def render(self, context):
+    with timer('render', self.format):
+      return self.render_thumbnail(context)
+
+  def render_thumbnail(self, context):
     try:
       if context.has_key(self.var_or_id):
         var_or_id = context[self.var_or_id]
@@ -32,23 +116,67 @@ class ThumbnailNode(Node):
         var_or_id = self.var_or_id
 
       if type(var_or_id) is int or var_or_id.isdigit():
-        media = Media.objects.get(id=var_or_id)
+        media = get_media(context, int(var_or_id))
       else:
         media = context[var_or_id]
     except ObjectDoesNotExist:
-      return '<!-- failed to retrieve media with an id of "%d" -->' % var_or_id
+      return '<!-- failed to retrieve media with an id of "%s" -->' % var_or_id
 
-    thumbnail = media.thumbnail(self.format)
+    thumbnail = self.get_thumbnail(media)
     if thumbnail:
       if self.context_var:
         context[self.context_var] = thumbnail
         return ''
       else:
-        context = Context({'thumbnail':thumbnail, 'extra':self.extra, 'site':Site.objects.get_current()})
-        return loader.render_to_string(thumbnail.format['template'], context)
+        context = Context({'thumbnail':thumbnail, 'extra':self.extra, 'site':get_site(context)})
+        return get_thumbnail_template(thumbnail.format['template']).render(context)
+    elif media.kind == 'i':
+      return '<!-- failed to generate a thumbnail of media %s -->' % media.id
     else:
       return ''
 
+  def get_thumbnail(self, media):
+    return media.thumbnail(self.format)
+
+
+class ThumbnailSrcsetNode(ThumbnailNode):
+  def __init__(self, var_or_id, context_var=None, format=None, densities='1,2', **extra):
+    ThumbnailNode.__init__(self, var_or_id, context_var, format, **extra)
+    try:
+      self.densities = sorted([float(d) for d in densities.split(',')])
+    except ValueError:
+      raise TemplateSyntaxError(_("densities must be a comma-separated list of numbers: '%s'") % densities)
+
+  def get_thumbnail(self, media):
+    # the thumbnail for the lowest density, with the others as its variants
+    base = compute_format(settings.MULTIMEDIA_FORMATS['default'], self.format)
+    formats = []
+    seen = set()
+    for density in self.densities:
+      format = scale_format(base, density)
+      dimensions = compute_thumbnail_dimensions((media.width,media.height), format)
+      if dimensions not in seen: # otherwise the media is too small for this density
+        seen.add(dimensions)
+        formats.append(format)
+    thumbnails = [t for t in media.create_thumbnails(formats) if t]
+    if not thumbnails:
+      return None
+    thumbnail = thumbnails[0]
+    if not thumbnail.pending:
+      # variants still being generated in the background are left out until they exist
+      thumbnail.variants = [(t, '%gx' % round(float(t.width) / thumbnail.width, 2)) for t in thumbnails if not t.pending]
+    return thumbnail
+
+
+class PrefetchMediaNode(Node):
+  def __init__(self, nodelist):
+    self.nodelist = nodelist
+    self.ids      = media_ids(nodelist)
+
+  def render(self, context):
+    prefetch_media(context, self.ids)
+    return self.nodelist.render(context)
+
 
 class RecentMediaNode(Node):
   def __init__(self, count, context_var):
@@ -56,7 +184,7 @@ class RecentMediaNode(Node):
     self.context_var = context_var
 
   def render(self, context):
-    context[self.context_var] = Media.objects.order_by('-imported')[:self.count]
+    context[self.context_var] = defer_metadata(Media.objects.order_by('-imported'))[:self.count]
     return ''
 
 
@@ -87,16 +215,41 @@ def do_thumbnail(parser, token):
     The thumbnail stored in 'context_var' has the following attributes:
 
       media     the Media object for this thumbnail
-      format    the format setting (as a dictionary)
+      format    the format setting (a Format object, readable like a dictionary)
       url       the url to the thumbnail image
       width     the width of the thumbnail image
       height    the height of the thumbnail image
 
   """
+  return parse_thumbnail_tag(token, ThumbnailNode)
+
+
+def do_thumbnail_srcset(parser, token):
+  """
+  Like the thumbnail tag, but also generates (with a single decode of the
+  media file) a thumbnail for each of several screen densities, listed in the
+  thumbnail's srcset attribute. Densities the media file is too small for are
+  left out.
+
+  Usage::
+
+    {% thumbnail_srcset [id|object] with format=400x400,square densities=1,2,3 %}
+    {% thumbnail_srcset [id|object] with format=400x400,square densities=1,2,3 as [context_var] %}
+
+  The thumbnail for the first density has two extra attributes:
+
+    variants  a list of (thumbnail, density descriptor) pairs, e.g. (thumbnail, '2x')
+    srcset    the value of an <img> srcset attribute listing all the variants
+
+  """
+  return parse_thumbnail_tag(token, ThumbnailSrcsetNode)
+
+
+def parse_thumbnail_tag(token, node_class):
   bits = token.contents.split()
   len_bits = len(bits)
   if len_bits == 2:
-    return ThumbnailNode(bits[1])
+    return node_class(bits[1])
   elif len_bits >= 4:
     if bits[2] != 'with':
       raise TemplateSyntaxError(_("second argument to %s tag must be 'with'") % bits[0])
@@ -112,8 +265,8 @@ def do_thumbnail(parser, token):
         name, value = arg.split('=',1)
         kwargs[str(name)] = str(value)
       except ValueError:
-        raise TemplateSyntaxError(_("%s tag was given a badly formatted option: '%s'") % (bits[0],bits[i]))
-    return ThumbnailNode(bits[1],context_var,**kwargs)
+        raise TemplateSyntaxError(_("%s tag was given a badly formatted option: '%s'") % (bits[0],arg))
+    return node_class(bits[1],context_var,**kwargs)
   else:
     raise TemplateSyntaxError(_('%s tag requires either one or 3+ arguments') % bits[0])
 
@@ -141,6 +294,29 @@ def do_recent_media(parser,token):
     raise TemplateSyntaxError(_('%s tag requires four arguments') % bits[0])
 
 
+def do_prefetch_media(parser, token):
+  """
+  Fetches the media objects referred to by id in the enclosed thumbnail tags
+  with a single query, instead of one query per tag.
+
+  Usage::
+
+    {% prefetch_media %}
+      ...
+      {% thumbnail 15 with format=600x400 %}
+      {% thumbnail 16 with format=600x400 %}
+      ...
+    {% endprefetch_media %}
+
+  """
+  bits = token.contents.split()
+  if len(bits) != 1:
+    raise TemplateSyntaxError(_('%s tag takes no arguments') % bits[0])
+  nodelist = parser.parse(('endprefetch_media',))
+  parser.delete_first_token()
+  return PrefetchMediaNode(nodelist)
+
+
 def thumbnail_url(media,format=None):
   thumbnail = media.thumbnail(format)
   if thumbnail:
@@ -150,8 +326,18 @@ def thumbnail_url(media,format=None):
 
 
 def render_multimedia_tags(s):
-  t = Template("{% load multimedia_tags %}\n" + s)
+  if type(s) is UnicodeType:
+    key = md5(s.encode('utf-8')).hexdigest()
+  else:
+    key = md5(s).hexdigest()
+  cached = tags_templates.get(key)
+  if cached is None:
+    t = Template("{% load multimedia_tags %}\n" + s)
+    cached = (t, media_ids(t.nodelist))
+    tags_templates.set(key, cached)
+  t, ids = cached
   c = Context()
+  prefetch_media(c, ids)
   return t.render(c)
 
 
@@ -162,7 +348,9 @@ def strip_multimedia_tags(s):
 
 
 register.tag('thumbnail', do_thumbnail)
+register.tag('thumbnail_srcset', do_thumbnail_srcset)
 register.tag('recent_media', do_recent_media)
+register.tag('prefetch_media', do_prefetch_media)
 register.filter(thumbnail_url)
 register.filter(render_multimedia_tags)
 register.filter(strip_multimedia_tags)
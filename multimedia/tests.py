@@ -0,0 +1,205 @@
+import unittest
+from cStringIO import StringIO
+
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from PIL import Image
+
+from multimedia import settings
+from multimedia import storage as multimedia_storage
+from multimedia import workers
+from multimedia.models import Media
+from multimedia.registry import get_registry
+from multimedia.storage import get_storage, get_thumbnail_storage
+from multimedia.utilities import compute_format, thumbnail_name_re
+from multimedia.views import etag_matches
+
+
+FORMATS = ['100x100', '200x200,square,round=10,bg=ffffff', '50x50,square,round=10,type=png,quality=50',
+           '80x80,round=0,progressive,optimize']
+
+
+def thumbnail_name(media, format):
+  return media.thumbnail_name(compute_format(settings.MULTIMEDIA_FORMATS['default'], format))
+
+
+class ThumbnailNameTest(unittest.TestCase):
+  def thumbnail_names(self, name):
+    media = Media(mediafile=name)
+    return [thumbnail_name(media, format) for format in FORMATS]
+
+  def setUp(self):
+    self.thumbnail_root = settings.MULTIMEDIA_THUMBNAIL_ROOT
+    settings.MULTIMEDIA_THUMBNAIL_ROOT = None
+
+  def tearDown(self):
+    settings.MULTIMEDIA_THUMBNAIL_ROOT = self.thumbnail_root
+
+  def test_matches_own_thumbnails(self):
+    pattern = thumbnail_name_re('img')
+    for name in self.thumbnail_names('content/img.jpg'):
+      self.assert_(pattern.match(name.split('/')[-1]), name)
+
+  def test_ignores_thumbnails_of_other_files(self):
+    # img-2.jpg and img-200x200.jpg start like img.jpg, and the thumbnails of
+    # img-200x200.jpg even start like a 200x200 thumbnail of img.jpg
+    pattern = thumbnail_name_re('img')
+    for name in self.thumbnail_names('content/img-2.jpg') + self.thumbnail_names('content/img-200x200.jpg'):
+      self.failIf(pattern.match(name.split('/')[-1]), name)
+    for name in ['img.jpg', 'tn-img.jpg', 'tn-img-100x100.jpg.bak', 'tn-imgx-100x100.jpg']:
+      self.failIf(pattern.match(name), name)
+
+  def test_escapes_basename(self):
+    self.failIf(thumbnail_name_re('a.b').match('tn-axb-100x100.jpg'))
+    self.assert_(thumbnail_name_re('a.b').match('tn-a.b-100x100.jpg'))
+
+
+class FormatTest(unittest.TestCase):
+  def test_dimensions_default_to_those_of_the_default_format(self):
+    default = compute_format(settings.MULTIMEDIA_FORMATS['default'])
+    self.assertEqual(compute_format('square').dimensions, default.dimensions)
+
+  def test_rejects_unknown_fields(self):
+    self.assertRaises(ValueError, compute_format, 'sq')
+
+
+class ETagTest(unittest.TestCase):
+  def test_matches_lists_weak_tags_and_star(self):
+    for header in ['"a"', '"b", "a"', '"b",W/"a"', '*']:
+      self.assert_(etag_matches(header, '"a"'), header)
+    for header in [None, '', '"b"', '"b", "c"', '"a-b"']:
+      self.failIf(etag_matches(header, '"a"'), header)
+
+
+class MediaFilesTestCase(TestCase):
+  "Saves media files in a directory of the media storage that is removed afterwards."
+
+  directory = 'multimedia-tests'
+
+  def setUp(self):
+    self.settings = {}
+    for name, value in [('MULTIMEDIA_THUMBNAIL_ROOT', None), ('MULTIMEDIA_THUMBNAIL_ASYNC', False),
+                        ('MULTIMEDIA_MAX_DIMENSIONS', None), ('MULTIMEDIA_DEDUPE', False)]:
+      self.settings[name] = getattr(settings, name)
+      setattr(settings, name, value)
+    # ids are reused across tests, so nothing cached about earlier media may survive
+    get_registry().clear()
+    multimedia_storage._thumbnail_files = None
+    self.storage = get_storage()
+
+  def tearDown(self):
+    for name, value in self.settings.items():
+      setattr(settings, name, value)
+    for storage in (self.storage, get_thumbnail_storage()):
+      try:
+        filenames = storage.listdir(self.directory)[1]
+      except OSError:
+        continue
+      for filename in filenames:
+        storage.delete('%s/%s' % (self.directory, filename))
+
+  def save_file(self, filename, color):
+    buffer = StringIO()
+    Image.new('RGB', (60, 40), color).save(buffer, 'JPEG')
+    name = '%s/%s' % (self.directory, filename)
+    self.failIf(self.storage.exists(name), 'left over from an earlier run: %s' % name)
+    return self.storage.save(name, ContentFile(buffer.getvalue()))
+
+  def create_media(self, filename, color):
+    media = Media(mediafile=self.save_file(filename, color))
+    media.save()
+    return media
+
+  def thumbnail_exists(self, media, format):
+    return get_thumbnail_storage().exists(thumbnail_name(media, format))
+
+
+class DeleteThumbnailsTest(MediaFilesTestCase):
+  def test_deletes_only_own_thumbnails(self):
+    media = self.create_media('img.jpg', 'red')
+    others = [self.create_media('img-2.jpg', 'green'), self.create_media('img-200x200.jpg', 'blue')]
+    for m in [media] + others:
+      m.create_thumbnails(FORMATS)
+    media.delete_thumbnails()
+    for format in FORMATS:
+      self.failIf(self.thumbnail_exists(media, format))
+      for other in others:
+        self.assert_(self.thumbnail_exists(other, format))
+
+  def test_keeps_thumbnails_shared_with_a_duplicate(self):
+    settings.MULTIMEDIA_DEDUPE = True
+    original = self.create_media('img.jpg', 'red')
+    duplicate = self.create_media('copy.jpg', 'red')
+    self.assertEqual(duplicate.mediafile.name, original.mediafile.name)
+    duplicate.create_thumbnails(FORMATS)
+    duplicate.delete()
+    for format in FORMATS:
+      self.assert_(self.thumbnail_exists(original, format))
+    original.delete()
+    for format in FORMATS:
+      self.failIf(self.thumbnail_exists(original, format))
+
+
+class ReuseFileTest(MediaFilesTestCase):
+  def setUp(self):
+    MediaFilesTestCase.setUp(self)
+    self.original = self.create_media('img.jpg', 'red')
+
+  def test_copies_original(self):
+    media = Media(mediafile=self.save_file('upload.jpg', 'red'))
+    media.reuse_file(self.original)
+    self.assertEqual(media.mediafile.name, self.original.mediafile.name)
+    self.assertEqual((media.width, media.height, media.content_hash, media.dhash),
+                     (self.original.width, self.original.height, self.original.content_hash, self.original.dhash))
+
+  def test_deletes_uploaded_copy(self):
+    upload = self.save_file('upload.jpg', 'red')
+    Media(mediafile=upload).reuse_file(self.original)
+    self.failIf(self.storage.exists(upload))
+
+  def test_keeps_file_used_by_other_media(self):
+    shared = self.create_media('shared.jpg', 'red')
+    Media(mediafile=shared.mediafile.name).reuse_file(self.original)
+    self.assert_(self.storage.exists(shared.mediafile.name))
+
+  def test_save_reuses_identical_upload(self):
+    settings.MULTIMEDIA_DEDUPE = True
+    upload = self.save_file('upload.jpg', 'red')
+    media = Media(mediafile=upload)
+    media.save()
+    self.assertEqual(media.mediafile.name, self.original.mediafile.name)
+    self.failIf(self.storage.exists(upload))
+    self.assertEqual(list(media.duplicates()), [self.original])
+
+  def test_save_keeps_different_upload(self):
+    settings.MULTIMEDIA_DEDUPE = True
+    upload = self.save_file('upload.jpg', 'blue')
+    media = Media(mediafile=upload)
+    media.save()
+    self.assertEqual(media.mediafile.name, upload)
+    self.assert_(self.storage.exists(upload))
+
+
+class AsyncFailureTest(MediaFilesTestCase):
+  def setUp(self):
+    MediaFilesTestCase.setUp(self)
+    self.queue_dir = settings.MULTIMEDIA_THUMBNAIL_QUEUE_DIR
+    settings.MULTIMEDIA_THUMBNAIL_QUEUE_DIR = None
+    settings.MULTIMEDIA_THUMBNAIL_ASYNC = True
+    self.queue = workers._queue = workers.ThumbnailQueue()
+    self.media = self.create_media('broken.jpg', 'red')
+    self.storage.delete(self.media.mediafile.name)
+    self.storage.save(self.media.mediafile.name, ContentFile('not an image'))
+
+  def tearDown(self):
+    workers._queue = None
+    settings.MULTIMEDIA_THUMBNAIL_QUEUE_DIR = self.queue_dir
+    MediaFilesTestCase.tearDown(self)
+
+  def test_remembers_failures(self):
+    self.media.thumbnail() # pending, unless the worker already failed
+    self.queue.join()
+    self.assertEqual(self.media.thumbnail(), None)
+    name = thumbnail_name(self.media, None)
+    self.assert_(self.queue.failed(name))
+    self.failIf(self.queue.enqueue(self.media.mediafile.name, None, name))
@@ -0,0 +1,6 @@
+from django.conf.urls.defaults import *
+
+
+urlpatterns = patterns('multimedia.views',
+  url(r'^(?P<media_id>\d+)/(?P<format_name>[\w-]+)/$', 'thumbnail', name='multimedia-thumbnail'),
+)
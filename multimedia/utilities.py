@@ -1,19 +1,140 @@
+from __future__ import with_statement
+
+import base64
+import math
 import os
 import os.path
 import re
-from subprocess import Popen, PIPE
+import stat
 import string
+import tempfile
+import threading
+import time
 import types
+from cStringIO import StringIO
 
+from django.core.files.base import ContentFile
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
 from PIL import Image, ImageFilter
 from roundcorners import round_image
 from multimedia import settings
+from multimedia.duplicates import dhash, file_hash
+from multimedia.exif import EXIF_TAGS, get_exiftool, read_exif
+from multimedia.instrumentation import count, timer
+from multimedia.lru import LRUCache
 
 
 dimension_re = re.compile(r'^(\d+)x(\d+)$',re.IGNORECASE)
 
+# rw-r--r--, the mode of written media files and thumbnails
+FILE_MODE = stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH
+
+# thumbnail types (the type= format setting) and the extensions of their files
+IMAGE_EXTENSIONS = {'jpeg':'.jpg', 'png':'.png', 'gif':'.gif', 'webp':'.webp'}
+IMAGE_TYPES = {'.jpg':'jpeg', '.jpeg':'jpeg', '.png':'png', '.gif':'gif', '.webp':'webp'}
+
+class Format(object):
+  """
+  A compiled thumbnail format, as returned by compute_format(). Formats are
+  immutable and hashable, and precompute the suffix of their thumbnails'
+  names. Fields can be read as attributes or, like the dictionaries returned
+  by parse_format(), as items: format.square or format['square'].
+  """
+  fields   = ('dimensions','square','round','bg','template','type','quality','progressive','optimize')
+  defaults = {'dimensions':None, 'square':False, 'round':0, 'bg':'ffffff', 'template':None,
+              'type':None, 'quality':None, 'progressive':False, 'optimize':False}
+  __slots__ = fields + ('suffix','_hash')
+
+  def __init__(self, **fields):
+    for name in self.fields:
+      value = fields.get(name,self.defaults[name])
+      if type(value) is types.ListType:
+        value = tuple(value)
+      object.__setattr__(self,name,value)
+    if not self.dimensions:
+      raise ValueError('Thumbnail format without dimensions: %r' % dict([item for item in fields.items() if item[1] is not None]))
+    object.__setattr__(self,'suffix',self.compute_suffix())
+    object.__setattr__(self,'_hash',hash(self.values()))
+
+  def compute_suffix(self):
+    # a string of the form "-200x200-sq-rd10-bgff0000"
+    s = '-%sx%s' % self.dimensions
+    if self.square:
+      s += "-sq"
+    if self.round != 0:
+      s += "-rd" + str(self.round)
+    if self.bg != 'ffffff':
+      s += '-bg' + self.bg
+    if self.quality:
+      s += '-q' + str(self.quality)
+    if self.progressive:
+      s += '-p'
+    if self.optimize:
+      s += '-o'
+    return s
+
+  def extension(self, ext):
+    "Returns the extension of thumbnails of a file with the given extension."
+    if self.type:
+      return IMAGE_EXTENSIONS[self.type]
+    return ext.lower()
+
+  def values(self):
+    return tuple([getattr(self,name) for name in self.fields])
+
+  def items(self):
+    return zip(self.fields,self.values())
+
+  def __setattr__(self, name, value):
+    raise AttributeError('Format objects are immutable')
+
+  def __getitem__(self, name):
+    if name not in self.fields:
+      raise KeyError(name)
+    return getattr(self,name)
+
+  def get(self, name, default=None):
+    if name not in self.fields:
+      return default
+    return getattr(self,name)
+
+  def has_key(self, name):
+    return name in self.fields
+
+  __contains__ = has_key
+
+  def __eq__(self, other):
+    return isinstance(other,Format) and self.values() == other.values()
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return self._hash
+
+  def __reduce__(self):
+    return (make_format, (dict(self.items()),))
+
+  def __repr__(self):
+    return '<Format %s>' % ', '.join(['%s=%r' % item for item in self.items()])
+
+
+def thumbnail_name_re(basename):
+  "Returns a regular expression matching the names of the thumbnails of a file with the given basename."
+  return re.compile(r'^tn-%s-\d+x\d+(-sq)?(-rd\d+)?(-bg[^-.]+)?(-q\d+)?(-p)?(-o)?\.\w+$' % re.escape(basename))
+
+
+def make_format(fields):
+  return Format(**fields)
+
+
 def parse_format(format):
   "Format has the form '200x200,square,round=10,bg=ffffff'. All fields are optional."
+  if isinstance(format,Format):
+    return dict(format.items())
   if type(format) is types.DictionaryType: # already parsed
     return format
   result = {}
@@ -36,6 +157,21 @@ def parse_format(format):
         result[name] = value.lower()
       elif name == 'template':
         result[name] = value
+      elif name == 'type':
+        value = value.lower()
+        if value == 'jpg':
+          value = 'jpeg'
+        if not IMAGE_EXTENSIONS.has_key(value):
+          raise ValueError('Unknown thumbnail type "%s"' % value)
+        if not can_encode(value):
+          raise ValueError('PIL can\'t encode thumbnails of type "%s"' % value)
+        result[name] = value
+      elif name == 'quality':
+        result[name] = int(value)
+      elif name in ('progressive','optimize'):
+        result[name] = True
+      elif name in ('!progressive','!optimize'):
+        result[name[1:]] = False
       elif name.startswith(':'):
         name = name[1:]
         if settings.MULTIMEDIA_FORMATS.has_key(name):
@@ -47,15 +183,60 @@ def parse_format(format):
         else:
           raise ValueError('Unknown named format "%s"' % name)
       else:
-        raise ValueError('Unknown thumbnail format name or setting:',name)
+        raise ValueError('Unknown thumbnail format name or setting "%s"' % name)
   return result
 
 
+# compiled formats, keyed by the arguments of compute_format() and by themselves
+formats = LRUCache(1000)
+
 def compute_format(first,second=None,third=None):
-  result = parse_format(first)
-  result.update( parse_format(second) )
-  result.update( parse_format(third)  )
-  return result
+  """
+  Returns the Format resulting from applying the given formats, each a format
+  string, a parsed format or a Format, in order. Formats are compiled once
+  and interned, so equal formats are the same object. Formats without
+  dimensions get those of the default format.
+  """
+  key = (first,second,third)
+  try:
+    format = formats.get(key)
+  except TypeError: # parsed formats aren't hashable
+    key = None
+    format = None
+  if format is None:
+    result = dict(parse_format(first))
+    result.update( parse_format(second) )
+    result.update( parse_format(third)  )
+    if not result.get('dimensions'):
+      result['dimensions'] = parse_format(settings.MULTIMEDIA_FORMATS['default']).get('dimensions')
+    format = Format(**result)
+    format = formats.get(format) or format
+    formats.set(format,format)
+    if key is not None:
+      formats.set(key,format)
+  return format
+
+
+def scale_format(format,factor):
+  "Returns format with its dimensions and corner radius multiplied by factor, e.g. for high density screens."
+  width, height = format.dimensions
+  return compute_format(format,'%dx%d,round=%d' % (round(width*factor),round(height*factor),round(format.round*factor)))
+
+
+def compile_formats():
+  "Compiles the named formats in MULTIMEDIA_FORMATS (each applied to the default format)."
+  for name in settings.MULTIMEDIA_FORMATS:
+    compute_format(settings.MULTIMEDIA_FORMATS['default'],settings.MULTIMEDIA_FORMATS[name])
+
+
+def format_key(format):
+  "Returns a hashable, normalized version of a parsed format."
+  if isinstance(format,Format):
+    return format
+  return compute_format(format)
+
+
+compile_formats()
 
 
 def compute_square_crop(dimensions):
@@ -69,60 +250,374 @@ def compute_square_crop(dimensions):
   return crop
 
 
-def make_thumbnail(src,format,dst):
-  image = Image.open(src)
-  # square
-  if format['square']:
-    crop = compute_square_crop(image.size)
-    image = image.crop(crop)
-  # dimensions
-  image.thumbnail(format['dimensions'], Image.ANTIALIAS)
-  # round
-  if format['round']:
-    image = round_image(image,radius=format['round'],bg_color='#'+format['bg']);
-  # save
-  image.save(dst)
+def make_thumbnail(src,format,dst,draft=True):
+  make_thumbnails(src,[(format,dst)],draft)
+
+
+def make_thumbnails(src,jobs,draft=True,storage=None):
+  """
+  Makes thumbnails of several formats from a single decode of src (a path or
+  an open file). Jobs is a list of (format, dst) pairs, where dst is a path,
+  or a name in storage if given. Thumbnails are made largest to smallest, each
+  one from the previous (unrounded) thumbnail of the same shape as long as
+  that is still large enough, so the original is only scaled down once.
+  If draft is True, JPEGs are decoded at a reduced scale (see draft_image).
+  """
+  with timer('open'):
+    image = Image.open(src)
+  if draft:
+    draft_image(image,[format for format,dst in jobs])
+  with timer('decode'):
+    image.load()
+  jobs = [(compute_thumbnail_dimensions(image.size,format),format,dst) for format,dst in jobs]
+  jobs.sort(key=lambda job: job[0][0]*job[0][1], reverse=True)
+  # the latest intermediate image, cropped to a square or not
+  intermediates = {False: image, True: None}
+  for dimensions, format, dst in jobs:
+    square = bool(format.square)
+    source = intermediates[square]
+    if source is None or not covers(source.size,dimensions):
+      source = intermediates[False]
+      if not covers(source.size,dimensions):
+        source = image
+      # square
+      if square:
+        with timer('crop',format):
+          source = source.crop(compute_square_crop(source.size))
+          if not covers(source.size,dimensions):
+            source = image.crop(compute_square_crop(image.size))
+    # dimensions
+    with timer('resize',format):
+      thumbnail = source.resize(compute_thumbnail_dimensions(source.size,format), Image.ANTIALIAS)
+    intermediates[square] = thumbnail
+    # round
+    if format.round:
+      with timer('round',format):
+        thumbnail = round_image(thumbnail.copy(),radius=format.round,bg_color='#'+format.bg)
+    # save
+    with timer('encode',format):
+      save_thumbnail(thumbnail,format,dst,storage)
+    count('generate',format)
+
+
+def save_thumbnail(image,format,dst,storage=None):
+  "Saves a thumbnail with the encoder options of its format."
+  _, ext = os.path.splitext(dst)
+  options = {}
+  if format.quality:
+    options['quality'] = format.quality
+  if format.optimize:
+    options['optimize'] = True
+  if IMAGE_TYPES.get(ext.lower()) == 'jpeg':
+    # JPEG has no alpha; rounded corners are already filled with the background color
+    if image.mode not in ('RGB','L','CMYK'):
+      image = image.convert('RGB')
+    if format.progressive:
+      options['progressive'] = True
+  if storage is None:
+    save_image(image,dst,**options)
+  else:
+    write_image(image,storage,dst,**options)
+
+
+def draft_image(image,formats):
+  """
+  Configures the decoder of a JPEG image that hasn't been loaded yet to decode
+  at the smallest scale (1/2, 1/4 or 1/8) that still covers the thumbnails of
+  all the given formats, which saves most of the memory and time spent
+  decoding large originals. Crops are then computed on the reduced image.
+  """
+  if image.format != 'JPEG':
+    return
+  width, height = image.size
+  side = min(width,height)
+  scale = 0.0
+  for format in formats:
+    w, h = compute_thumbnail_dimensions(image.size,format)
+    if format.square:
+      scale = max(scale, float(w)/side, float(h)/side)
+    else:
+      scale = max(scale, float(w)/width, float(h)/height)
+  if scale < 1:
+    image.draft(image.mode,(int(math.ceil(width*scale)),int(math.ceil(height*scale))))
+
+
+def covers(size,dimensions):
+  return size[0] >= dimensions[0] and size[1] >= dimensions[1]
+
+
+def save_image(image,dst,**options):
+  "Saves image to a temporary file next to dst and renames it into place, so readers never see a partial file."
+  head, tail = os.path.split(dst)
+  _, ext = os.path.splitext(tail)
+  if not os.path.isdir(head):
+    try:
+      os.makedirs(head)
+    except OSError: # created concurrently
+      if not os.path.isdir(head):
+        raise
+  fd, tmp = tempfile.mkstemp(prefix='.tmp-',suffix=ext,dir=head)
+  os.close(fd)
+  try:
+    image.save(tmp,**options)
+    os.chmod(tmp,FILE_MODE)
+    os.rename(tmp,dst)
+  except:
+    if os.path.exists(tmp):
+      os.remove(tmp)
+    raise
+
+
+def write_image(image,storage,name,**options):
+  """
+  Saves image as name in storage, replacing any existing file, and returns
+  name. Local files are written with save_image; other storages get the
+  encoded image in a single save(). Storages can't overwrite, so the
+  existing file is deleted first; if another process saves name in between,
+  save() picks another name, and that copy is discarded in favor of the
+  other process's file. Raises IOError if name can't be written.
+  """
+  path = local_path(storage,name)
+  if path:
+    save_image(image,path,**options)
+    return name
+  if 'format' not in options:
+    options['format'] = image_format(name)
+  buffer = StringIO()
+  image.save(buffer,**options)
+  if storage.exists(name):
+    storage.delete(name)
+  saved = storage.save(name,ContentFile(buffer.getvalue()))
+  if saved != name:
+    storage.delete(saved)
+    if not storage.exists(name):
+      raise IOError('%s was saved as %s' % (name,saved))
+  return name
+
+
+def can_encode(type):
+  "Returns True if PIL can save images of a thumbnail type, e.g. 'webp' needs PIL built with libwebp."
+  Image.init()
+  return Image.SAVE.has_key(type.upper())
+
+
+def image_format(name):
+  "Returns the PIL format of a file name's extension, e.g. 'JPEG' for 'a.jpg'."
+  _, ext = os.path.splitext(name)
+  Image.init()
+  return Image.EXTENSION.get(ext.lower(),'JPEG')
+
+
+def local_path(storage,name):
+  "Returns the local path of a file in storage, or None if the storage isn't local."
+  try:
+    return storage.path(name)
+  except NotImplementedError:
+    return None
+
+
+def open_file(storage,name):
+  "Opens a file in storage for reading; remote files are read in one request."
+  path = local_path(storage,name)
+  if path:
+    return open(path,'rb')
+  f = storage.open(name,'rb')
+  try:
+    return StringIO(f.read())
+  finally:
+    f.close()
 
 
 def compute_thumbnail_dimensions(src,format):
   width, height = src
+  max_width, max_height = format.dimensions
   # square
-  if format['square']:
+  if format.square:
     crop = compute_square_crop(src)
     width, height = crop[2]-crop[0], crop[3]-crop[1]
   # dimensions
-  x_factor = float(width)  / format['dimensions'][0]
-  y_factor = float(height) / format['dimensions'][1]
+  x_factor = float(width)  / max_width
+  y_factor = float(height) / max_height
   if x_factor > y_factor:
     if x_factor > 1:
-      width, height = format['dimensions'][0], int(height / x_factor)
+      width, height = max_width, max(int(height / x_factor), 1)
   else:
     if y_factor > 1:
-      width, height = int(width / y_factor), format['dimensions'][1]
+      width, height = max(int(width / y_factor), 1), max_height
   return width, height
   
   
-def update_media(media):
-  filepath = media.mediafile.path
-  _, ext = os.path.splitext(filepath)
-  if ext.lower() in ['.gif','.jpg','.jpeg','.png','tif','tiff']:
-    # extract metadata
-    metadata = extract_exif(filepath)
-    # get dimensions
-    image = Image.open(filepath)
-    width,height = image.size
-    # resize file
-    if settings.MULTIMEDIA_MAX_DIMENSIONS:
-      if width  > settings.MULTIMEDIA_MAX_DIMENSIONS[0] or \
-         height > settings.MULTIMEDIA_MAX_DIMENSIONS[1]:
-        image.thumbnail(settings.MULTIMEDIA_MAX_DIMENSIONS, Image.ANTIALIAS)
-        image.save(filepath)
-    # update fields
-    media.kind        = 'i'
-    media.width       = width
-    media.height      = height
-    media.taken       = parse_date(metadata.get('DateTimeOriginal',None))
-    media.metadata    = string.join(map(lambda i: i[0]+': '+i[1], metadata.items()),'\n')
+def update_media(media,content_hash=None):
+  storage = media.mediafile.storage
+  name = media.mediafile.name
+  _, ext = os.path.splitext(name)
+  # hash of the file as uploaded, before it is downscaled
+  if content_hash is None:
+    f = open_file(storage,name)
+    try:
+      content_hash = file_hash(f)
+    finally:
+      f.close()
+  media.content_hash = content_hash
+  if ext.lower() in ['.gif','.jpg','.jpeg','.png','.tif','.tiff']:
+    f = open_file(storage,name)
+    try:
+      # get dimensions
+      image = Image.open(f)
+      width,height = image.size
+      # extract metadata
+      metadata = extract_exif(local_path(storage,name),image)
+      # resize file
+      if settings.MULTIMEDIA_MAX_DIMENSIONS and \
+         (width  > settings.MULTIMEDIA_MAX_DIMENSIONS[0] or \
+          height > settings.MULTIMEDIA_MAX_DIMENSIONS[1]):
+        name,(width,height) = downscale_original(storage,name,image,settings.MULTIMEDIA_MAX_DIMENSIONS)
+        media.mediafile.name = name
+      # computed from the downscaled image, or else from a reduced-scale decode
+      small = reduced_image(image)
+      media.dhash = dhash(small)
+      media.dominant_color, media.placeholder = make_placeholder(small)
+      # update fields
+      media.kind        = 'i'
+      media.width       = width
+      media.height      = height
+      media.taken       = parse_date(metadata.get('DateTimeOriginal',None))
+      media.metadata    = string.join(map(lambda i: i[0]+': '+i[1], metadata.items()),'\n')
+      for field, value in metadata_fields(metadata).items():
+        setattr(media,field,value)
+    finally:
+      f.close()
+  media.signature = file_signature(storage,name)
+
+
+def reduced_image(image):
+  """
+  Returns image in RGB, decoded at the smallest scale that still covers
+  MULTIMEDIA_PLACEHOLDER_SIZE if it is a JPEG that hasn't been loaded yet,
+  for computing both its difference hash and its placeholder. Classic PIL,
+  unlike Pillow, doesn't ignore a second draft() call, so it is made only here.
+  """
+  size = max(settings.MULTIMEDIA_PLACEHOLDER_SIZE,9)
+  image.draft(image.mode,(size,size))
+  if image.mode != 'RGB':
+    image = image.convert('RGB')
+  return image
+
+
+def make_placeholder(image,size=None):
+  """
+  Returns the dominant color of image (as 'rrggbb') and a blurred preview at
+  most size pixels wide and high (MULTIMEDIA_PLACEHOLDER_SIZE by default), as
+  a data URI small enough to be inlined in pages.
+  """
+  if size is None:
+    size = settings.MULTIMEDIA_PLACEHOLDER_SIZE
+  small = image.convert('RGB')
+  small.thumbnail((size,size),Image.ANTIALIAS)
+  # the most frequent of a few representative colors
+  palette = small.convert('P',palette=Image.ADAPTIVE,colors=4)
+  pixels, index = max(palette.getcolors())
+  color = '%02x%02x%02x' % tuple(palette.getpalette()[index*3:index*3+3])
+  preview = small.filter(ImageFilter.BLUR)
+  buffer = StringIO()
+  try:
+    preview.save(buffer,'WEBP',quality=40)
+    type = 'webp'
+  except (IOError,KeyError): # PIL without WebP support
+    buffer = StringIO()
+    preview.save(buffer,'JPEG',quality=40)
+    type = 'jpeg'
+  return color, 'data:image/%s;base64,%s' % (type,base64.b64encode(buffer.getvalue()))
+
+
+def metadata_fields(metadata):
+  """
+  Returns the values of the structured metadata fields of Media (camera_make,
+  camera_model, focal_length, iso and exif) given a dictionary of EXIF tags.
+  """
+  return {
+    'camera_make':  metadata.get('Make','')[:64],
+    'camera_model': metadata.get('Model','')[:64],
+    'focal_length': parse_number(metadata.get('FocalLength'),float),
+    'iso':          parse_number(metadata.get('ISO'),int),
+    'exif':         metadata and json.dumps(metadata,sort_keys=True) or '',
+  }
+
+
+def parse_metadata(text):
+  "Parses the \"Tag: value\" lines of Media.metadata back into a dictionary."
+  result = {}
+  for line in (text or '').split('\n'):
+    if ': ' in line:
+      tag, value = line.split(': ',1)
+      result[tag] = value
+  return result
+
+
+def parse_number(s,type):
+  # e.g. '50.0 mm' -> 50.0
+  if s:
+    try:
+      return type(s.split()[0])
+    except ValueError:
+      return None
+  return None
+
+
+# bounds the number of originals being downscaled at once (see downscale_original)
+decode_semaphore = threading.BoundedSemaphore(settings.MULTIMEDIA_MAX_CONCURRENT_DECODES)
+
+def downscale_original(storage,name,image,max_dimensions):
+  """
+  Replaces the file name in storage, opened as image (but not yet loaded),
+  with a version that fits within max_dimensions, and returns its name and
+  size. JPEGs are decoded at a reduced scale, and at most
+  MULTIMEDIA_MAX_CONCURRENT_DECODES originals are decoded at once. The
+  original is never lost: local files are renamed into place, and on other
+  storages the downscaled version is saved under a new name (the one
+  returned) before the original is deleted.
+  """
+  dimensions = compute_thumbnail_dimensions(image.size,Format(dimensions=max_dimensions))
+  decode_semaphore.acquire()
+  try:
+    options = {}
+    if image.info.get('exif'):
+      options['exif'] = image.info['exif']
+    format = image.format
+    image.draft(image.mode,dimensions)
+    image.load() # before thumbnail(), whose own draft() classic PIL wouldn't ignore
+    image.thumbnail(dimensions,Image.ANTIALIAS)
+    if local_path(storage,name):
+      write_image(image,storage,name,format=format,**options)
+      return name, image.size
+    buffer = StringIO()
+    image.save(buffer,format=format,**options)
+    saved = storage.save(name,ContentFile(buffer.getvalue()))
+    if saved != name: # storages that overwrite return name itself
+      storage.delete(name)
+    return saved, image.size
+  finally:
+    decode_semaphore.release()
+
+
+def file_signature(storage,name):
+  "Returns a string that changes whenever the file is modified, based on its size and mtime."
+  path = local_path(storage,name)
+  if path:
+    try:
+      st = os.stat(path)
+    except OSError:
+      return ''
+    return '%d:%d' % (st.st_size, st.st_mtime)
+  try:
+    size = storage.size(name)
+  except (IOError,OSError):
+    return ''
+  try:
+    mtime = time.mktime(storage.modified_time(name).timetuple())
+  except (IOError,OSError,NotImplementedError):
+    mtime = 0
+  return '%d:%d' % (size, mtime)
 
 
 def parse_date(s):
@@ -130,23 +625,33 @@ def parse_date(s):
   from time import strptime
   if s:
     try:
-      return datetime(*strptime('2008:12:27 13:00:04',"%Y:%m:%d %H:%M:%S")[:5])
+      return datetime(*strptime(s,"%Y:%m:%d %H:%M:%S")[:5])
     except ValueError:
       return None
   else:
     return None
 
 
-def extract_exif(filepath):
-  # execute "exiftool -s -t [set of tags] [filepath]" and parse the output
-  tags = ['Make','Model','DateTimeOriginal','FocalLength','ShutterSpeed','Aperture','ISO','Flash']
-  tag_args = "-" + string.join(tags," -")
-  cmd = "exiftool -s -t %s %s" % (tag_args,filepath)
-  p = Popen(cmd, shell=True, stdout=PIPE)
-  lines = p.communicate()[0].strip().split('\n')
-  result = {}
-  for l in lines:
-    if l:
-      tag,value = l.split('\t')
-      result[tag] = value
-  return result
+def import_object(path):
+  "Imports an object given its dotted path, e.g. 'multimedia.registry.ThumbnailRegistry'."
+  module, name = path.rsplit('.',1)
+  return getattr(__import__(module, {}, {}, [name]), name)
+
+
+def extract_exif(filepath,image=None):
+  """
+  Returns a dictionary of the EXIF tags in EXIF_TAGS. The tags are read from
+  the already open PIL image, if given, and otherwise from the file using
+  exiftool (see multimedia/exif.py), if it is local (filepath isn't None).
+  """
+  with timer('exif'):
+    if image is not None:
+      result = read_exif(image)
+      if result is not None:
+        return result
+    if filepath and settings.MULTIMEDIA_EXIFTOOL:
+      try:
+        return get_exiftool(settings.MULTIMEDIA_EXIFTOOL).extract(filepath,EXIF_TAGS)
+      except (IOError,OSError):
+        pass
+    return {}
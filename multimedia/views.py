@@ -0,0 +1,97 @@
+from __future__ import with_statement
+
+import mimetypes
+import time
+from hashlib import md5
+
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.shortcuts import get_object_or_404
+from django.utils.encoding import smart_str
+from django.utils.http import http_date, urlquote
+from django.views.static import was_modified_since
+
+from multimedia import settings
+from multimedia.models import Media
+from multimedia.storage import get_thumbnail_storage
+from multimedia.utilities import compute_format, file_signature, local_path
+
+
+def thumbnail(request, media_id, format_name):
+  """
+  Serves the thumbnail of a named format, generating it first if it doesn't
+  exist yet. Its url doesn't change as long as the media object and the
+  format keep their names, so it can be cached by browsers and CDNs
+  (see MULTIMEDIA_THUMBNAIL_CACHE_CONTROL). Conditional requests are answered
+  with 304 Not Modified, and the file itself can be left to the web server
+  (see MULTIMEDIA_SENDFILE_HEADER).
+  """
+  if not settings.MULTIMEDIA_FORMATS.has_key(format_name):
+    raise Http404
+  media = get_object_or_404(Media, id=media_id)
+  format = compute_format(settings.MULTIMEDIA_FORMATS['default'],settings.MULTIMEDIA_FORMATS[format_name])
+  # generated here even if MULTIMEDIA_THUMBNAIL_ASYNC is set, since the browser is waiting for it
+  name = media.create_thumbnail(format)
+  if not name:
+    raise Http404
+
+  storage = get_thumbnail_storage()
+  signature = file_signature(storage,name)
+  etag = '"%s"' % md5(smart_str(name + signature)).hexdigest()
+  try:
+    mtime = time.mktime(storage.modified_time(name).timetuple())
+  except (IOError,OSError,NotImplementedError):
+    mtime = None
+  if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag) or \
+     (mtime and 'HTTP_IF_NONE_MATCH' not in request.META and
+      not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime)):
+    response = HttpResponseNotModified()
+  else:
+    response = file_response(storage, name)
+  response['ETag'] = etag
+  if mtime:
+    response['Last-Modified'] = http_date(mtime)
+  if settings.MULTIMEDIA_THUMBNAIL_CACHE_CONTROL:
+    response['Cache-Control'] = settings.MULTIMEDIA_THUMBNAIL_CACHE_CONTROL
+  return response
+
+
+def etag_matches(header, etag):
+  "Tells whether an If-None-Match header, a comma-separated list of (possibly weak) ETags or *, matches etag."
+  if not header:
+    return False
+  for tag in header.split(','):
+    tag = tag.strip()
+    if tag.startswith('W/'):
+      tag = tag[2:]
+    if tag == '*' or tag == etag:
+      return True
+  return False
+
+
+def file_response(storage, name):
+  content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+  header = settings.MULTIMEDIA_SENDFILE_HEADER
+  path = local_path(storage,name)
+  if header == 'X-Accel-Redirect':
+    # nginx serves the file from the internal location MULTIMEDIA_SENDFILE_ROOT
+    response = HttpResponse('', content_type=content_type)
+    response[header] = settings.MULTIMEDIA_SENDFILE_ROOT.rstrip('/') + '/' + urlquote(name)
+  elif header and path:
+    response = HttpResponse('', content_type=content_type)
+    response[header] = smart_str(path) # headers are bytes; the web server reads the path as UTF-8
+  else:
+    f = storage.open(name,'rb')
+    response = HttpResponse(stream(f), content_type=content_type)
+    try:
+      response['Content-Length'] = str(storage.size(name))
+    except (IOError,OSError,NotImplementedError):
+      pass
+  return response
+
+
+def stream(f):
+  try:
+    for chunk in f.chunks():
+      yield chunk
+  finally:
+    f.close()
@@ -0,0 +1,242 @@
+"""
+Background thumbnail generation.
+
+When MULTIMEDIA_THUMBNAIL_ASYNC is set, missing thumbnails are handed to a
+pool of worker threads instead of being generated while a template renders.
+Jobs are deduplicated per thumbnail: within a process by a set of pending
+jobs, and across processes by an exclusive job file in
+MULTIMEDIA_THUMBNAIL_QUEUE_DIR (if set). Job files left behind by a process
+that died are picked up again once they are older than
+MULTIMEDIA_THUMBNAIL_QUEUE_TIMEOUT. Thumbnails that failed to generate
+aren't queued again for MULTIMEDIA_THUMBNAIL_FAILURE_TIMEOUT seconds.
+"""
+from __future__ import with_statement
+
+import logging
+import os
+import os.path
+import threading
+import time
+import Queue
+from hashlib import md5
+
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+
+from django.utils.encoding import smart_str
+
+from multimedia import settings
+from multimedia.lru import LRUCache
+from multimedia.storage import get_storage, get_thumbnail_files
+from multimedia.utilities import FILE_MODE, make_thumbnails, open_file
+
+
+logger = logging.getLogger('multimedia')
+
+
+class KeyedLock(object):
+  "Hands out one lock per key, so that work on the same key is serialized."
+
+  def __init__(self):
+    self._locks = {} # key -> [lock, number of holders and waiters]
+    self._lock  = threading.Lock()
+
+  def acquire(self, key):
+    with self._lock:
+      entry = self._locks.setdefault(key, [threading.Lock(), 0])
+      entry[1] += 1
+    entry[0].acquire()
+
+  def release(self, key):
+    with self._lock:
+      entry = self._locks[key]
+      entry[1] -= 1
+      if not entry[1]:
+        del self._locks[key]
+    entry[0].release()
+
+
+# held while a thumbnail is generated, keyed by the thumbnail's name
+thumbnail_locks = KeyedLock()
+
+
+def generate_thumbnail(src,format,dst):
+  """
+  Generates a thumbnail unless it already exists, never more than once at a
+  time per thumbnail. src is the name of the media file in the media storage
+  and dst the name of the thumbnail in the thumbnail storage.
+  """
+  generate_thumbnails(src,[(format,dst)])
+
+
+def generate_thumbnails(src,jobs):
+  "Like generate_thumbnail(), for a list of (format, dst) pairs generated with a single decode of src."
+  files = get_thumbnail_files()
+  names = sorted(set([dst for format,dst in jobs])) # a fixed order avoids deadlocks
+  for dst in names:
+    thumbnail_locks.acquire(dst)
+  try:
+    exists = files.exists_many(names,listing=bool(settings.MULTIMEDIA_THUMBNAIL_ROOT))
+    jobs = [(format,dst) for format,dst in jobs if not exists[dst]]
+    if jobs:
+      f = open_file(get_storage(),src)
+      try:
+        make_thumbnails(f,jobs,storage=files.storage)
+      finally:
+        f.close()
+      for format,dst in jobs:
+        files.add(dst)
+  finally:
+    for dst in names:
+      thumbnail_locks.release(dst)
+
+
+class ThumbnailQueue(object):
+  def __init__(self, workers=None, spool=None, timeout=None, failure_timeout=None):
+    if workers is None:
+      workers = settings.MULTIMEDIA_THUMBNAIL_WORKERS
+    if spool is None:
+      spool = settings.MULTIMEDIA_THUMBNAIL_QUEUE_DIR
+    if timeout is None:
+      timeout = settings.MULTIMEDIA_THUMBNAIL_QUEUE_TIMEOUT
+    if failure_timeout is None:
+      failure_timeout = settings.MULTIMEDIA_THUMBNAIL_FAILURE_TIMEOUT
+    self.workers = workers
+    self.spool   = spool
+    self.timeout = timeout
+    self.failure_timeout = failure_timeout
+    self.queue   = Queue.Queue()
+    self.pending = set()
+    self.failures = LRUCache(1000) # dst -> time until which it isn't queued again
+    self.threads = []
+    self._lock   = threading.Lock()
+    if spool and not os.path.isdir(spool):
+      os.makedirs(spool)
+
+  def enqueue(self, src, format, dst, retry=False):
+    """
+    Queues a thumbnail for generation. Returns False if it is already queued,
+    or if it recently failed to generate (unless retry is True).
+    """
+    job = (src,format,dst)
+    if retry:
+      self.failures.delete(dst)
+    elif self.failed(dst):
+      return False
+    with self._lock:
+      if dst in self.pending or not self._claim(job):
+        return False
+      self.pending.add(dst)
+      self._start()
+    self.queue.put(job)
+    return True
+
+  def join(self):
+    "Blocks until every queued thumbnail has been generated."
+    self.queue.join()
+
+  def failed(self, dst):
+    "Returns True if the thumbnail failed to generate less than failure_timeout seconds ago."
+    expires = self.failures.get(dst)
+    return expires is not None and expires > time.time()
+
+  def _start(self):
+    if self.threads:
+      return
+    for i in range(max(self.workers,1)):
+      thread = threading.Thread(target=self._work, name='multimedia-thumbnailer-%d' % i)
+      thread.setDaemon(True)
+      thread.start()
+      self.threads.append(thread)
+    self._recover()
+
+  def _work(self):
+    while True:
+      src, format, dst = self.queue.get()
+      try:
+        try:
+          generate_thumbnail(src,format,dst)
+        except Exception:
+          self.failures.set(dst, time.time() + self.failure_timeout)
+          logger.exception('failed to generate thumbnail %s' % dst)
+      finally:
+        with self._lock:
+          self.pending.discard(dst)
+          self._unclaim(dst)
+        self.queue.task_done()
+
+  def _job_path(self, dst):
+    return os.path.join(self.spool, md5(smart_str(dst)).hexdigest() + '.job')
+
+  def _claim(self, job):
+    # creates the job file, failing if another process already holds a fresh one
+    if not self.spool:
+      return True
+    path = self._job_path(job[2])
+    for attempt in (1,2):
+      try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, FILE_MODE)
+      except OSError:
+        if attempt == 1 and self._is_stale(path):
+          self._remove(path)
+          continue
+        return False
+      f = os.fdopen(fd,'wb')
+      try:
+        pickle.dump(job,f,pickle.HIGHEST_PROTOCOL)
+      finally:
+        f.close()
+      return True
+    return False
+
+  def _unclaim(self, dst):
+    if self.spool:
+      self._remove(self._job_path(dst))
+
+  def _recover(self):
+    # requeues jobs whose owner died before finishing them
+    if not self.spool or not os.path.isdir(self.spool):
+      return
+    for filename in os.listdir(self.spool):
+      path = os.path.join(self.spool,filename)
+      if not filename.endswith('.job') or not self._is_stale(path):
+        continue
+      try:
+        f = open(path,'rb')
+        try:
+          job = pickle.load(f)
+        finally:
+          f.close()
+      except Exception:
+        self._remove(path)
+        continue
+      self._remove(path)
+      if job[2] not in self.pending and self._claim(job):
+        self.pending.add(job[2])
+        self.queue.put(job)
+
+  def _is_stale(self, path):
+    try:
+      return time.time() - os.path.getmtime(path) > self.timeout
+    except OSError:
+      return True
+
+  def _remove(self, path):
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue():
+  "Returns the process-wide thumbnail queue."
+  global _queue
+  with _queue_lock:
+    if _queue is None:
+      _queue = ThumbnailQueue()
+    return _queue